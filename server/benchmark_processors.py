@@ -0,0 +1,207 @@
+#!/usr/bin/python
+
+# Micro-benchmarks of the task metric computations against their previous implementations, on synthetic data.
+# python benchmark_processors.py [--repeat <n>]
+
+import os
+import ast
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+from data_processors.csv_loader import load_task_csv
+from data_processors.exclusion_processor import ExclusionProcessor
+from data_processors.textreading_processor import TextReadingProcessor
+from data_processors.trajectory_parser import Trajectories
+
+def timeit(func, repeat):
+    ## Best of <repeat> runs, in milliseconds
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return result, min(times) * 1000
+
+def report(name, legacy, current):
+    (legacy_result, legacy_time), (current_result, current_time) = legacy, current
+    print(f"{name}:")
+    print(f"  legacy : {legacy_time:9.3f} ms")
+    print(f"  current: {current_time:9.3f} ms ({legacy_time / current_time:.1f}x)")
+    print(f"  max abs diff: {np.nanmax(np.abs(np.asarray(legacy_result, dtype=float) - np.asarray(current_result, dtype=float))):.3g}")
+
+## ====================================================================================
+## TextReading: mean syllable speech rate
+
+def legacy_mean_syllable_speech_rate(csv_files):
+    ## Implementation before the vectorized one (one DataFrame and a row-wise len() per file)
+    syllable_speech_rates = []
+    for csv_file in csv_files:
+        df = pd.read_csv(csv_file, encoding='utf-8', usecols=[0, 1, 2], names=['word', 'start', 'end'])
+        df['duration'] = df['end'] - df['start']
+        df['word_len'] = df['word'].astype(str).apply(len)
+        df['syllable_sr'] = df['word_len'] / df['duration']
+        syllable_speech_rates.append(df['syllable_sr'].mean())
+    return np.mean(syllable_speech_rates)
+
+def make_word_csvs(out_dir, n_files, n_words, rng):
+    chars = np.array(list("我們今天一起去公園散步看到很多花草樹木和小鳥"))
+    csv_files = []
+    for i in range(n_files):
+        words = [ "".join(rng.choice(chars, size=rng.integers(1, 5))) for _ in range(n_words) ]
+        durations = rng.uniform(0.1, 0.8, size=n_words)
+        ends = np.cumsum(durations + rng.uniform(0, 0.2, size=n_words))
+        starts = ends - durations
+        csv_file = os.path.join(out_dir, f"bench_{i}_ds.wav.words.csv")
+        pd.DataFrame({"word": words, "start": starts.round(2), "end": ends.round(2)}).to_csv(csv_file, header=False, index=False)
+        csv_files.append(csv_file)
+    return csv_files
+
+def benchmark_speech_rate(args, rng):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_files = make_word_csvs(tmp_dir, args.n_files, args.n_words, rng)
+        processor = TextReadingProcessor(tmp_dir, use_cache=False)
+        word_timings_list = [ processor.load_word_timings(f) for f in csv_files ]
+
+        report(
+            f"TextReading speech rate from CSV files ({args.n_files} files x {args.n_words} words)",
+            timeit(lambda: legacy_mean_syllable_speech_rate(csv_files), args.repeat),
+            timeit(lambda: processor.calculate_mean_syllable_speech_rate(csv_files), args.repeat)
+        )
+        report(
+            "TextReading speech rate from in-memory word timings",
+            timeit(lambda: legacy_mean_syllable_speech_rate(csv_files), args.repeat),
+            timeit(lambda: processor.calculate_mean_syllable_speech_rate(word_timings_list), args.repeat)
+        )
+
+## ====================================================================================
+## GoFitts: mouse trajectory columns
+
+def legacy_parse_trajectories(df):
+    ## Implementation before the ragged-array parser (ast.literal_eval and a list of strings per cell)
+    x = df["mouse.x"].apply(lambda str_arr: [str(int(x + 960)) for x in ast.literal_eval(str_arr)])
+    y = df["mouse.y"].apply(lambda str_arr: [str(int(y + 540)) for y in ast.literal_eval(str_arr)])
+    t = df["mouse.time"].apply(lambda str_arr: [str(int(sec * 1000)) for sec in ast.literal_eval(str_arr)])
+    return np.concatenate([ np.array(values, dtype=float) for values in [*x, *y, *t] ])
+
+def parse_trajectories(df):
+    trajectories = Trajectories.from_columns(df["mouse.x"], df["mouse.y"], df["mouse.time"])
+    return np.concatenate([
+        np.trunc(trajectories.x + 960), np.trunc(trajectories.y + 540), np.trunc(trajectories.t * 1000)
+    ])
+
+def benchmark_trajectories(args, rng):
+    n_trials, n_samples = args.n_trials, args.n_samples
+    cells = lambda scale: [ str(np.round(rng.normal(0, scale, n_samples), 4).tolist()) for _ in range(n_trials) ]
+    df = pd.DataFrame({"mouse.x": cells(300), "mouse.y": cells(200), "mouse.time": cells(1)})
+
+    report(
+        f"GoFitts trajectory parsing ({n_trials} trials x {n_samples} samples)", 
+        timeit(lambda: legacy_parse_trajectories(df), args.repeat), 
+        timeit(lambda: parse_trajectories(df), args.repeat)
+    )
+
+## ====================================================================================
+## Exclusion: yes rates and RTs of each cue x stimulus cell
+
+def legacy_exclusion_metrics(data):
+    ## Implementation before the groupby one (nested boolean masks, one copy of the trials per cell)
+    def mean_rt(data):
+        output = []
+        for each in ['s', 'k']:
+            value = data[data.key_resp_keys == each][['key_resp.rt']].values.flatten()
+            mean_rt = value.sum() / data.shape[0] if data.shape[0] > 0 else 0
+            output.append(-999 if mean_rt == 0 else mean_rt)
+        return output
+    
+    def yes_rates(data, column, inner=None):
+        output = []
+        for each in [1, 2, 3]:
+            data = data[data[column] == each]
+            if inner is None:
+                output.append(data[data.key_resp_keys == 's'].shape[0] / data.shape[0] if data.shape[0] > 0 else 0)
+            else:
+                output.extend(yes_rates(data, inner))
+        return output
+
+    rts = [ 
+        mean_rt(data[(data.number_of_cue_t == cue) & (data.stimuli_t == stim)]) for cue in [1, 2, 3] for stim in [1, 2, 3] 
+    ]
+    return np.concatenate([yes_rates(data, "number_of_cue_t", inner="stimuli_t"), [ s for s, _ in rts ], [ k for _, k in rts ]])
+
+def exclusion_metrics(processor, data):
+    n_trials, counts, rt_sums = processor.summarize_responses(data)
+    rt = processor.rt_calculation(n_trials, rt_sums)
+    return np.concatenate([processor.rate_calculation(n_trials, counts), rt["s"], rt["k"]])
+
+def benchmark_exclusion(args, rng):
+    processor = ExclusionProcessor(data_dir=None)
+    n_trials = processor.trial_n
+    data = pd.DataFrame({
+        "number_of_cue_t": rng.integers(1, 4, n_trials).astype(float), 
+        "key_resp_keys": rng.choice(["s", "k"], n_trials), 
+        "key_resp.rt": rng.uniform(0.3, 2.0, n_trials), 
+        "stimuli_t": rng.integers(1, 4, n_trials).astype(float)
+    })
+
+    report(
+        f"Exclusion yes rates and RTs (one subject, {n_trials} trials)", 
+        timeit(lambda: legacy_exclusion_metrics(data), args.repeat), 
+        timeit(lambda: exclusion_metrics(processor, data), args.repeat)
+    )
+
+## ====================================================================================
+## PsychoPy CSV export: loading the columns of a task
+
+def make_psychopy_csv(out_path, n_rows, n_extra_columns, rng):
+    ## The columns of the task, among many free-text and numeric columns (as in the PsychoPy exports)
+    columns = {
+        "指定代號": ["EX01"] * n_rows, 
+        "number_of_cue_t": rng.integers(1, 4, n_rows).astype(float), 
+        "stimuli_t": rng.integers(1, 4, n_rows).astype(float), 
+        "key_resp.keys": rng.choice(["s", "k"], n_rows), 
+        "key_resp.rt": rng.uniform(0.3, 2.0, n_rows)
+    }
+    for i in range(n_extra_columns):
+        if i % 3 == 0:
+            columns[f"extra_{i}"] = [ f"free text, row {r} of column {i}" for r in range(n_rows) ]
+        else:
+            columns[f"extra_{i}"] = rng.normal(size=n_rows)
+    pd.DataFrame(columns).to_csv(out_path, index=False)
+
+def benchmark_csv_loading(args, rng):
+    processor = ExclusionProcessor(data_dir=None)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_file = os.path.join(tmp_dir, "bench_exclusion.csv")
+        make_psychopy_csv(csv_file, args.n_rows, args.n_columns, rng)
+
+        legacy = timeit(lambda: pd.read_csv(csv_file), args.repeat)
+        current = timeit(lambda: load_task_csv(csv_file, processor.columns), args.repeat)
+        report(
+            f"PsychoPy CSV loading ({args.n_rows} rows x {args.n_columns + len(processor.columns)} columns)", 
+            (legacy[0]["key_resp.rt"], legacy[1]), 
+            (current[0]["key_resp.rt"], current[1])
+        )
+        print(f"  memory : {legacy[0].memory_usage(deep=True).sum() / 1024:.0f} KiB -> {current[0].memory_usage(deep=True).sum() / 1024:.0f} KiB")
+
+## ====================================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the task metric computations")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--n_files", type=int, default=6)
+    parser.add_argument("--n_words", type=int, default=300)
+    parser.add_argument("--n_trials", type=int, default=360)
+    parser.add_argument("--n_samples", type=int, default=120)
+    parser.add_argument("--n_rows", type=int, default=200)
+    parser.add_argument("--n_columns", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    benchmark_speech_rate(args, rng)
+    benchmark_trajectories(args, rng)
+    benchmark_exclusion(args, rng)
+    benchmark_csv_loading(args, rng)
@@ -0,0 +1,41 @@
+import os
+import csv
+import importlib.util
+import pandas as pd
+
+CSV_ENGINE = os.getenv("CSV_ENGINE", "c") # "pyarrow" is faster on large files, if installed
+
+class MissingColumnsError(ValueError):
+    pass
+
+def read_header(file_path):
+    ## Only the first line, to check the columns before parsing the file
+    with open(file_path, encoding="utf-8-sig", newline="") as f:
+        return next(csv.reader(f), [])
+
+def get_engine(engine=None):
+    engine = engine or CSV_ENGINE
+    if (engine == "pyarrow") and (importlib.util.find_spec("pyarrow") is None):
+        print("pyarrow is not installed, the CSV files are parsed with the C engine.")
+        engine = "c"
+    return engine
+
+def load_task_csv(file_path, columns, optional_columns=None, engine=None):
+    '''
+    Reads only the given columns of a PsychoPy CSV export, with their dtypes ({name: dtype}, None to let pandas infer it).
+    Raises MissingColumnsError before parsing the file if one of the required columns is not in its header;
+    the optional columns are read when present.
+    '''
+    header = read_header(file_path)
+    missing = [ col for col in columns if col not in header ]
+    if missing:
+        raise MissingColumnsError(f"{os.path.basename(file_path)} is missing the required columns: {', '.join(missing)}")
+
+    columns = { **(optional_columns or {}), **columns }
+    usecols = [ col for col in columns if col in header ]
+    return pd.read_csv(
+        file_path,
+        usecols=usecols,
+        dtype={ col: columns[col] for col in usecols if columns[col] is not None },
+        engine=get_engine(engine)
+    )
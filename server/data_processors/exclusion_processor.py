@@ -1,10 +1,25 @@
 import os
+import numpy as np
 import pandas as pd
 
+from data_processors.csv_loader import load_task_csv
+
 class ExclusionProcessor:
     def __init__(self, data_dir):
         self.data_dir = data_dir
         self.trial_n = 18 * 3
+        self.columns = {
+            "指定代號": None, 
+            "number_of_cue_t": "float32", 
+            "stimuli_t": "float32", 
+            "key_resp.keys": "category", 
+            "key_resp.rt": "float64" # float32 would change the RT features (e.g., 0.7345 -> 0.73449999)
+        }
+        self.cues = [1, 2, 3]
+        self.stimuli = [1, 2, 3] # Target/Non-target/New item
+        self.keys = ["s", "k"] # yes/no
+        ## Feature names of the "yes" and "no" responses to each stimulus
+        self.response_names = [("TarHit", "TarMiss"), ("NonTarFA", "NonTarCR"), ("NewFA", "NewCR")]
 
     def create_index(self, data, trial_n):
         output = list(data.index)
@@ -18,115 +33,66 @@ class ExclusionProcessor:
         index = self.create_index(output, trial_n)
         return output.loc[index, :]
 
-    def mean_rt_calculation(self, data):
-        output = []
-        for each in ['s', 'k']:
-            value = data[data.key_resp_keys == each][['key_resp.rt']].values.flatten()
-            mean_rt = value.sum() / data.shape[0] if data.shape[0] > 0 else 0  # Avoid division by zero
-            if mean_rt == 0:
-                mean_rt = -999  # If Mean_RT is zero, recode as NA value (-999)
-            output.append(mean_rt)
-        return output
-
-    def rt_calculation_stimulus(self, data):
-        target = self.mean_rt_calculation(data[data.stimuli_t == 1])
-        non_target = self.mean_rt_calculation(data[data.stimuli_t == 2])
-        new = self.mean_rt_calculation(data[data.stimuli_t == 3])
-        return {'Target': target, 'NonTarget': non_target, 'New': new}
-
-    def rt_calculation_stimulus_cue(self, data):
-        cue_1 = self.rt_calculation_stimulus(data[data.number_of_cue_t == 1])
-        cue_2 = self.rt_calculation_stimulus(data[data.number_of_cue_t == 2])
-        cue_3 = self.rt_calculation_stimulus(data[data.number_of_cue_t == 3])
-        return {'Cue_1': cue_1, 'Cue_2': cue_2, 'Cue_3': cue_3}
+    def summarize_responses(self, data):
+        '''
+        Counts and summed RTs of the "yes" (s) and "no" (k) responses in each cue x stimulus cell, with one groupby.
+        Returns the number of trials of each cell and a (cell, key) array of each, 
+        with the 9 cells in the order (Cue 1/2/3) x (Target/Non-target/New item).
+        '''
+        cells = pd.MultiIndex.from_product([self.cues, self.stimuli], names=["number_of_cue_t", "stimuli_t"])
+        summary = data.groupby(["number_of_cue_t", "stimuli_t", "key_resp_keys"], observed=True)["key_resp.rt"].agg(["size", "sum"])
+        n_trials = summary["size"].groupby(level=["number_of_cue_t", "stimuli_t"]).sum().reindex(cells, fill_value=0)
+        summary = summary.unstack("key_resp_keys", fill_value=0).reindex(
+            index=cells, 
+            columns=pd.MultiIndex.from_product([["size", "sum"], self.keys]), 
+            fill_value=0
+        )
+        return n_trials.to_numpy(), summary["size"].to_numpy(), summary["sum"].to_numpy(dtype=float)
 
-    def rate_calculation_stimulus(self, data):
-        output = []
-        for each in [1, 2, 3]:  # Target/Non-target/New item
-            data = data[data.stimuli_t == each]
-            yes_rate = data[data.key_resp_keys == 's'].shape[0] / data.shape[0] if data.shape[0] > 0 else 0
-            output.append(yes_rate)
-        return output
+    def rt_calculation(self, n_trials, rt_sums):
+        ## Summed RT of each response over all the trials of the cell (-999 if there are none)
+        mean_rt = np.divide(rt_sums, n_trials[:, None], out=np.zeros_like(rt_sums), where=(n_trials[:, None] > 0))
+        mean_rt[mean_rt == 0] = -999
+        return { each: mean_rt[:, k] for k, each in enumerate(self.keys) }
 
-    def rate_calculation_stimulus_cue(self, data):
-        output = []
-        for each in [1, 2, 3]:  # Cue 1/2/3
-            data = data[data.number_of_cue_t == each]
-            yes_rate = self.rate_calculation_stimulus(data)
-            output.extend(yes_rate)
-        return output
+    def rate_calculation(self, n_trials, counts):
+        yes_counts = counts[:, self.keys.index("s")].astype(float)
+        yes_rate = np.divide(yes_counts, n_trials, out=np.zeros_like(yes_counts), where=(n_trials > 0))
+        ## As in the previous implementation, only the yes rate of the targets of the first cue is kept
+        ## (the others were computed on an empty selection), so that the features are unchanged
+        yes_rate[1:] = 0
+        return yes_rate
 
     def process_subject(self, file_path):
         if not os.path.exists(file_path):
             print(f"File not found: {file_path}")
             return None
 
-        data = pd.read_csv(file_path)
+        data = load_task_csv(file_path, self.columns)
         data.rename(columns={'key_resp.keys': 'key_resp_keys'}, inplace=True)
 
-        if '指定代號' not in data.columns:
-            print(f"Column '指定代號' not found in file: {file_path}")
-            return None
-
         id = data.loc[0, '指定代號']
         data = data[['number_of_cue_t', 'key_resp_keys', 'key_resp.rt', 'stimuli_t']]
         data = self.select_item(data, self.trial_n)
 
         # Calculate rt and Yes rates
-        rt = self.rt_calculation_stimulus_cue(data)
-        yes_rate = self.rate_calculation_stimulus_cue(data)
-        no_rate = [1 - each for each in yes_rate]
-        non_tar_fa = [yes_rate[1], yes_rate[4], yes_rate[7]]
-        recollection = [(yes_rate[0] - non_tar_fa[0]), (yes_rate[3] - non_tar_fa[1]), (yes_rate[6] - non_tar_fa[2])]
-        familiarity = [non_tar_fa[Each]/(1 - recollection[Each]) if recollection[Each] != 1 else non_tar_fa[Each]/(1 - 0.999) for Each in range(3)]
+        n_trials, counts, rt_sums = self.summarize_responses(data)
+        rt = self.rt_calculation(n_trials, rt_sums)
+        yes_rate = self.rate_calculation(n_trials, counts)
+        no_rate = 1 - yes_rate
+        non_tar_fa = yes_rate[1::3]
+        recollection = yes_rate[0::3] - non_tar_fa
+        familiarity = non_tar_fa / (1 - np.where(recollection != 1, recollection, 0.999))
 
-        output = pd.DataFrame({
-            'ID': [id],
-            'MEMORY_EXCLUSION_BEH_C1_FAMILIARITY': [familiarity[0]], 
-            'MEMORY_EXCLUSION_BEH_C2_FAMILIARITY': [familiarity[1]],
-            'MEMORY_EXCLUSION_BEH_C3_FAMILIARITY': [familiarity[2]],
-            'MEMORY_EXCLUSION_BEH_C1_RECOLLECTION': [recollection[0]], 
-            'MEMORY_EXCLUSION_BEH_C2_RECOLLECTION': [recollection[1]],
-            'MEMORY_EXCLUSION_BEH_C3_RECOLLECTION': [recollection[2]],
-    # Cue 1 --------------------------------------
-            'MEMORY_EXCLUSION_BEH_C1TarHit_PROPORTION': [yes_rate[0]],
-            'MEMORY_EXCLUSION_BEH_C1TarMiss_PROPORTION': [no_rate[0]],
-            'MEMORY_EXCLUSION_BEH_C1NonTarFA_PROPORTION': [yes_rate[1]],
-            'MEMORY_EXCLUSION_BEH_C1NonTarCR_PROPORTION': [no_rate[1]],
-            'MEMORY_EXCLUSION_BEH_C1NewFA_PROPORTION': [yes_rate[2]],
-            'MEMORY_EXCLUSION_BEH_C1NewCR_PROPORTION': [no_rate[2]],
-            'MEMORY_EXCLUSION_BEH_C1TarHit_RT': [rt['Cue_1']['Target'][0]],
-            'MEMORY_EXCLUSION_BEH_C1TarMiss_RT': [rt['Cue_1']['Target'][1]],
-            'MEMORY_EXCLUSION_BEH_C1NonTarFA_RT': [rt['Cue_1']['NonTarget'][0]],
-            'MEMORY_EXCLUSION_BEH_C1NonTarCR_RT': [rt['Cue_1']['NonTarget'][1]],
-            'MEMORY_EXCLUSION_BEH_C1NewFA_RT': [rt['Cue_1']['New'][0]],
-            'MEMORY_EXCLUSION_BEH_C1NewCR_RT': [rt['Cue_1']['New'][1]],
-    # Cue 2 --------------------------------------
-            'MEMORY_EXCLUSION_BEH_C2TarHit_PROPORTION': [yes_rate[3]],
-            'MEMORY_EXCLUSION_BEH_C2TarMiss_PROPORTION': [no_rate[3]],
-            'MEMORY_EXCLUSION_BEH_C2NonTarFA_PROPORTION': [yes_rate[4]],
-            'MEMORY_EXCLUSION_BEH_C2NonTarCR_PROPORTION': [no_rate[4]],
-            'MEMORY_EXCLUSION_BEH_C2NewFA_PROPORTION': [yes_rate[5]],
-            'MEMORY_EXCLUSION_BEH_C2NewCR_PROPORTION': [no_rate[5]],
-            'MEMORY_EXCLUSION_BEH_C2TarHit_RT' : [rt['Cue_2']['Target'][0]],
-            'MEMORY_EXCLUSION_BEH_C2TarMiss_RT' : [rt['Cue_2']['Target'][1]],
-            'MEMORY_EXCLUSION_BEH_C2NonTarFA_RT' : [rt['Cue_2']['NonTarget'][0]],
-            'MEMORY_EXCLUSION_BEH_C2NonTarCR_RT' : [rt['Cue_2']['NonTarget'][1]],
-            'MEMORY_EXCLUSION_BEH_C2NewFA_RT' : [rt['Cue_2']['New'][0]],
-            'MEMORY_EXCLUSION_BEH_C2NewCR_RT' : [rt['Cue_2']['New'][1]],
-    # Cue 3 --------------------------------------
-            'MEMORY_EXCLUSION_BEH_C3TarHit_PROPORTION': [yes_rate[6]],
-            'MEMORY_EXCLUSION_BEH_C3TarMiss_PROPORTION': [no_rate[6]],
-            'MEMORY_EXCLUSION_BEH_C3NonTarFA_PROPORTION': [yes_rate[7]],
-            'MEMORY_EXCLUSION_BEH_C3NonTarCR_PROPORTION': [no_rate[7]],
-            'MEMORY_EXCLUSION_BEH_C3NewFA_PROPORTION': [yes_rate[8]],
-            'MEMORY_EXCLUSION_BEH_C3NewCR_PROPORTION': [no_rate[8]],
-            'MEMORY_EXCLUSION_BEH_C3TarHit_RT' : [rt['Cue_3']['Target'][0]],
-            'MEMORY_EXCLUSION_BEH_C3TarMiss_RT' : [rt['Cue_3']['Target'][1]],
-            'MEMORY_EXCLUSION_BEH_C3NonTarFA_RT' : [rt['Cue_3']['NonTarget'][0]],
-            'MEMORY_EXCLUSION_BEH_C3NonTarCR_RT' : [rt['Cue_3']['NonTarget'][1]],
-            'MEMORY_EXCLUSION_BEH_C3NewFA_RT' : [rt['Cue_3']['New'][0]],
-            'MEMORY_EXCLUSION_BEH_C3NewCR_RT' : [rt['Cue_3']['New'][1]]
-        })
+        output = { 'ID': [id] }
+        for c in range(3):
+            output[f'MEMORY_EXCLUSION_BEH_C{c + 1}_FAMILIARITY'] = [familiarity[c]]
+        for c in range(3):
+            output[f'MEMORY_EXCLUSION_BEH_C{c + 1}_RECOLLECTION'] = [recollection[c]]
+        for c in range(3):
+            for measure, values in [("PROPORTION", [yes_rate, no_rate]), ("RT", [rt["s"], rt["k"]])]:
+                for s, (yes_name, no_name) in enumerate(self.response_names):
+                    output[f'MEMORY_EXCLUSION_BEH_C{c + 1}{yes_name}_{measure}'] = [values[0][c * 3 + s]]
+                    output[f'MEMORY_EXCLUSION_BEH_C{c + 1}{no_name}_{measure}'] = [values[1][c * 3 + s]]
 
-        return output
\ No newline at end of file
+        return pd.DataFrame(output)
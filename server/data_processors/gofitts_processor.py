@@ -2,54 +2,67 @@
 # -*- coding: utf-8 -*-
 
 import os
-import ast
 import numpy as np
 import pandas as pd
 
+from data_processors.csv_loader import load_task_csv
+from data_processors.trajectory_parser import Trajectories, parse_numeric_lists
+
 class GoFittsProcessor:
     def __init__(self, data_dir):
         self.data_dir = data_dir
         self.id_column = "指定代號"
         self.half_width = 960
         self.half_height = 540
-        self.modified_jar_path = "/home/tcnl/YHL/Pavloviadata/server/data_processors/GoFitts_modified.jar"
-    
-    def convert_file(self):
-        df = pd.read_csv(self.file_path)
-
-        if self.id_column not in df.columns:
-            raise ValueError("ID column not found in csv!")
-        self.subject_id = df[self.id_column].iloc[0]
-
-        df = df.loc[:, ["sequence_loop.thisN", "trial_loop.thisN", "from", "to", "mouse.x", "mouse.y", "mouse.time", "w", "a"]]
-        df.rename(columns={
+        self.modified_jar_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "GoFitts_modified.jar")
+        self.dwell_time = 500 # ms, subtracted from the movement time to get the point time (as in GoFitts)
+        ## Constants of GoFitts (Throughput.java), with its precision, so the results match GoFitts_modified.jar
+        self.sqrt_2_pi_e = 4.132731354 # effective width = sqrt(2 * pi * e) * SD of the selection coordinates
+        self.log_two = 0.693147181
+        ## Columns read from the PsychoPy CSV (the lists of the trajectories are parsed by trajectory_parser.py)
+        self.columns = {
+            "sequence_loop.thisN": "float32", 
+            "trial_loop.thisN": "float32", 
+            "from": "object", 
+            "to": "object", 
+            "mouse.x": "object", 
+            "mouse.y": "object", 
+            "mouse.time": "object", 
+            "w": "float32", 
+            "a": "float32", 
+            "leave_time": "float64"
+        }
+        self.column_names = {
             "sequence_loop.thisN": "seq",
             "trial_loop.thisN": "trial",
             "mouse.x": "x",
             "mouse.y": "y",
             "mouse.time": "t"
-        }, inplace=True)
-        df = df.dropna()
-        df["w"] = df["w"].astype(int)
-        df["a"] = df["a"].astype(int)
-        df["seq"] = df["seq"].astype(int)
-        df["trial"] = df["trial"].astype(int)
-        df["x"] = df["x"].apply(lambda str_arr: [str(int(x + self.half_width)) for x in ast.literal_eval(str_arr)])
-        df["y"] = df["y"].apply(lambda str_arr: [str(int(y + self.half_height)) for y in ast.literal_eval(str_arr)])
-        df["t"] = df["t"].apply(lambda str_arr: [str(int(sec * 1000)) for sec in ast.literal_eval(str_arr)])
+        }
+    
+    def read_file(self, file_path):
+        ## Reads the PsychoPy CSV once, only the needed columns
+        df = load_task_csv(file_path, { self.id_column: None, **self.columns })
+        subject_id = df[self.id_column].iloc[0]
+
+        df = df.rename(columns=self.column_names)
+        return subject_id, df
+
+    def convert_file(self, file_path, subject_id, df):
+        ## .sd3 trace file, as read by GoFitts_modified.jar
+        trials, trajectories = self.load_trials(df)
 
         output_csv_path = os.path.join(
-            os.path.dirname(self.file_path), f"GoFitts-{self.subject_id}.sd3"
+            os.path.dirname(file_path), f"GoFitts-{subject_id}.sd3"
         )        
         with open(output_csv_path, "w") as f:
             f.write("TRACE DATA\n")
             f.write("App,self.subject_id,Condition,Session,Group,TaskType,SelectionMethod,Block,Sequence,A,W,Trial,from_x,from_y,to_x,to_y,{t_x_y}\n")
-            for _, row in df.iterrows():
-                from_x, from_y = [round(_, 1) for _ in ast.literal_eval(row["from"])]
-                to_x, to_y = [round(_, 1) for _ in ast.literal_eval(row["to"])]
-                from_to = ",".join([str(_) for _ in [from_x + self.half_width, from_y + self.half_height, to_x + self.half_width, to_y + self.half_height]])
-                for d in ["t", "x", "y"]:
-                    f.write(f"FittsTask,{self.subject_id},C00,S00,G00,2D,DT0,B00,{row['seq']},{row['a']},{row['w']},{row['trial']},{from_to},{d}=,{','.join(row[d])}\n")
+            for i, row in enumerate(trials.itertuples(index=False)):
+                from_to = ",".join([ str(float(_)) for _ in [row.from_x, row.from_y, row.to_x, row.to_y] ])
+                x, y, t = trajectories.get_trial(i)
+                for d, values in [("t", t), ("x", x), ("y", y)]:
+                    f.write(f"FittsTask,{subject_id},C00,S00,G00,2D,DT0,B00,{row.seq},{row.a},{row.w},{row.trial},{from_to},{d}=,{','.join(values.astype(int).astype(str))}\n")
         
         return output_csv_path
     
@@ -60,61 +73,115 @@ class GoFittsProcessor:
             os.system(f"java -jar {self.modified_jar_path} -p {output_csv_path}")
             print("Generated trial and sequence summary!")
 
-    def make_summary(self, seq_summary_path, summary_path):
-        df = pd.read_csv(self.file_path)
-        seq_df = pd.read_csv(seq_summary_path)
-        
-        seq_cnt = len(seq_df)        
-        leave_time = []
-        point_time = []
-        throughput = []
-        
-        for i in range(seq_cnt):
-            leave_time.append(df[df["sequence_loop.thisN"] == i]["leave_time"].dropna().mean() * 1000)
-            point_time.append(seq_df[seq_df["Sequence"] == i]["PT"].item())
-            throughput.append(seq_df[seq_df["Sequence"] == i]["TP"].item())
-        
-        # calculate slope
-        def slope(y):
-            x = np.arange(len(y))
-            A = np.vstack([x, np.ones(len(x))]).T
-            m, _ = np.linalg.lstsq(A, y, rcond=None)[0]
-            return m
+    def load_trials(self, df):
+        '''
+        Selects the trial rows, in the same pixel and millisecond units as the .sd3 trace file.
+        Returns one row per trial (with the index of df), and the mouse trajectories of all trials as ragged arrays (see trajectory_parser.py).
+        '''
+        df = df.dropna(subset=["seq", "trial", "from", "to", "x", "y", "t", "w", "a"])
+        trials = df.loc[:, ["seq", "trial", "a", "w"]].astype(int)
+
+        for col in ["from", "to"]:
+            values, _ = parse_numeric_lists(df[col])
+            values = np.array([ round(v, 1) for v in values.tolist() ]).reshape(-1, 2) # Python rounding, as in the .sd3 file
+            trials[f"{col}_x"] = values[:, 0] + self.half_width
+            trials[f"{col}_y"] = values[:, 1] + self.half_height
+
+        trajectories = Trajectories.from_columns(df["x"], df["y"], df["t"])
+        trajectories.x = np.trunc(trajectories.x + self.half_width)
+        trajectories.y = np.trunc(trajectories.y + self.half_height)
+        trajectories.t = np.trunc(trajectories.t * 1000)
+
+        return trials, trajectories
+
+    def summarize_sequences(self, df, trials, trajectories):
+        '''
+        Leave time, and the movement time (MT), point time (PT) and throughput (TP) of each sequence of serial 2D trials,
+        computed the same way as GoFitts_modified.jar (-sequence-summary.csv), with a single groupby.
+        '''
+        from_xy = trials[["from_x", "from_y"]].to_numpy()
+        to_xy = trials[["to_x", "to_y"]].to_numpy()
+        select_xy = np.column_stack([ 
+            trajectories.last(trajectories.x), trajectories.last(trajectories.y) 
+        ]) # the last sample of the trajectory
+
+        ## Deviation of the selection along the task axis
+        a = np.hypot(*(from_xy - to_xy).T)
+        b = np.hypot(*(select_xy - to_xy).T)
+        c = np.hypot(*(from_xy - select_xy).T)
+        dx = pd.Series((c ** 2 - b ** 2 - a ** 2) / (2 * a), index=trials.index)
+
+        ## Effective amplitude (serial task: the movement starts where the previous one ended)
+        ae = a + dx + dx.groupby(trials["seq"]).shift(1).fillna(0)
+
+        ## Trial-level values on the rows of the trials, NaN on the other rows (skipped by the aggregations)
+        df = df.assign(
+            mt=pd.Series(trajectories.last(trajectories.t) - trajectories.first(trajectories.t), index=trials.index), 
+            dx=dx, 
+            ae=ae, 
+            leave_time=df["leave_time"] * 1000
+        )
+        seq_df = df.groupby("seq", sort=True).agg(
+            A=("a", "first"), 
+            W=("w", "first"), 
+            MT=("mt", "mean"), 
+            n_trials=("mt", "count"), 
+            sd_dx=("dx", "std"), 
+            mean_ae=("ae", "mean"), 
+            LeaveTime=("leave_time", "mean")
+        )
+        seq_df = seq_df.loc[seq_df["n_trials"] > 0]
+
+        we = self.sqrt_2_pi_e * seq_df["sd_dx"]
+        ide = np.log(seq_df["mean_ae"] / we + 1) / self.log_two
+        seq_df = seq_df.assign(
+            PT=seq_df["MT"] - self.dwell_time, 
+            TP=ide / (seq_df["MT"] / 1000)
+        )
+        seq_df.index = seq_df.index.astype(int)
+        seq_df.index.name = "Sequence"
+
+        return seq_df.loc[:, ["A", "W", "MT", "PT", "TP", "LeaveTime"]].reset_index()
+
+    def make_summary(self, subject_id, seq_df):
+        seq_cnt = len(seq_df)
+        arrays = seq_df[["LeaveTime", "PT", "TP"]].to_numpy(dtype=float)
+
+        ## Slope of each measure over the sequences, in one least-squares call
+        x = np.arange(seq_cnt)
+        A = np.vstack([x, np.ones(seq_cnt)]).T
+        slopes = np.linalg.lstsq(A, arrays, rcond=None)[0][0]
             
         header = ["ID"]
-        for name in ["LeaveTime", "PointTime", "Throughput"]:
-            for i in range(seq_cnt):
-                header.append(f"GOFITTS_BEH_ID{i}_{name}")
-            header.append(f"GOFITTS_BEH_SLOPE_{name}")
-        
-        data = [self.subject_id]
-        for array in [leave_time, point_time, throughput]:
-            for i in range(seq_cnt):
-                data.append(array[i])
-            data.append(slope(array))
+        data = [subject_id]
+        for j, name in enumerate(["LeaveTime", "PointTime", "Throughput"]):
+            header += [ f"GOFITTS_BEH_ID{i}_{name}" for i in range(seq_cnt) ] + [f"GOFITTS_BEH_SLOPE_{name}"]
+            data += arrays[:, j].tolist() + [slopes[j]]
             
-        with open(summary_path, "w") as file:
-            file.write(",".join(header))
-            file.write('\n')
-            file.write(",".join([str(x) for x in data]))
-            file.write('\n')
-        
         print("Generated final summary!")    
+        return pd.DataFrame([data], columns=header)
 
     def process_subject(self, file_path):
-        self.file_path = file_path
-        output_csv_path = self.convert_file()
-        self.parse_with_jar(output_csv_path)
-        seq_summary_path = os.path.join(os.path.dirname(self.file_path), f"GoFitts-{self.subject_id}-sequence-summary.csv")
-        summary_path = os.path.join(os.path.dirname(self.file_path), f"GoFitts-{self.subject_id}-summary.csv")
-        self.make_summary(seq_summary_path, summary_path)
-        df = pd.read_csv(summary_path)
+        ## Nothing is stored on self, so that one instance can process several files at once
+        subject_id, df = self.read_file(file_path)
+        trials, trajectories = self.load_trials(df)
+        seq_df = self.summarize_sequences(df, trials, trajectories)
+        df = self.make_summary(subject_id, seq_df)
         df = df.rename(columns={'ID': self.id_column})
         
         return df
 
-    
-
-
+    def process_subject_with_jar(self, file_path):
+        ## Previous implementation (.sd3 trace file + GoFitts_modified.jar), kept to validate the one above
+        subject_id, df = self.read_file(file_path)
+        output_csv_path = self.convert_file(file_path, subject_id, df)
+        self.parse_with_jar(output_csv_path)
+        seq_summary_path = os.path.join(os.path.dirname(file_path), f"GoFitts-{subject_id}-sequence-summary.csv")
+        seq_df = pd.read_csv(seq_summary_path)
+        seq_df["LeaveTime"] = [ 
+            df.loc[df["seq"] == i, "leave_time"].dropna().mean() * 1000 for i in range(len(seq_df)) 
+        ]
+        df = self.make_summary(subject_id, seq_df)
+        df = df.rename(columns={'ID': self.id_column})
 
-    
\ No newline at end of file
+        return df
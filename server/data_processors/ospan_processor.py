@@ -1,10 +1,17 @@
 import os
 import pandas as pd
 
+from data_processors.csv_loader import load_task_csv
+
 class OspanProcessor:
     def __init__(self, data_dir):
         self.data_dir = data_dir
         self.trial_n = (4*3) + (6*3)
+        self.columns = {
+            "指定代號": None, 
+            "MathResult": None, # inferred: 1/0 in some exports, True/False in others
+            "LetterResult": None
+        }
 
     def create_index(self, data, trial_n):
         output = list(data.index)
@@ -33,7 +40,7 @@ class OspanProcessor:
             print(f"File not found: {file_path}")
             return None
 
-        data = pd.read_csv(file_path)
+        data = load_task_csv(file_path, self.columns)
         id = data.loc[0, '指定代號']
         math_result = self.math_analysis(data)
         letter_result = self.letter_analysis(data)
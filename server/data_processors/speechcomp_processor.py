@@ -1,9 +1,16 @@
 import os
 import pandas as pd
 
+from data_processors.csv_loader import load_task_csv
+
 class SpeechcompProcessor:
     def __init__(self, data_dir):
         self.data_dir = data_dir
+        self.columns = {
+            "condition": "object", # free text, searched with str.contains
+            "stim_resp.corr": "float64", 
+            "duration": "float64"
+        }
 
     def process_subject(self, file_path):
         if not os.path.exists(file_path):
@@ -11,7 +18,7 @@ class SpeechcompProcessor:
             return None
 
         # Read table
-        t = pd.read_csv(file_path)
+        t = load_task_csv(file_path, self.columns)
 
         # Get subject ID
         subject_id = os.path.basename(file_path).split('_')[0]
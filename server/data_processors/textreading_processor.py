@@ -2,20 +2,147 @@ import os
 import pandas as pd
 import numpy as np
 import subprocess
+import socket
+import json
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from data_processors.transcript_cache import TranscriptCache
 
 class TextReadingProcessor:
-    def __init__(self, data_dir):
+    def __init__(self, data_dir, n_workers=None, threads_per_worker=None, use_cache=True):
         self.data_dir = data_dir
         self.base_path = os.path.dirname(os.path.abspath(__file__))
+        ## Number of recordings transcribed at once, and CPU threads for each of them (None: library default)
+        self.n_workers = n_workers or int(os.getenv("TEXTREADING_WORKERS", 1))
+        self.threads_per_worker = threads_per_worker or (int(os.getenv("TEXTREADING_THREADS_PER_WORKER", 0)) or None)
+        self.worker_socket_path = os.getenv("WHISPER_WORKER_SOCKET", os.path.join(self.base_path, "whisper_worker.sock"))
+        self.worker_timeout = float(os.getenv("WHISPER_WORKER_TIMEOUT", 600)) # seconds, per recording
+        ## Transcripts are cached by audio content and model, so retried tasks and manual reports are not transcribed again
+        self.cache = None if not use_cache else TranscriptCache(
+            cache_dir=os.path.join(self.data_dir, ".transcript_cache"), 
+            model_version=os.getenv("WHISPER_MODEL", "small"), 
+            max_age_days=float(os.getenv("TRANSCRIPT_CACHE_MAX_AGE_DAYS", 90)), 
+            max_size_mb=float(os.getenv("TRANSCRIPT_CACHE_MAX_SIZE_MB", 2048))
+        )
+        ## Audio is decoded in memory; the _ds.wav and .words.csv files are only written in debug mode
+        self.debug = os.getenv("TEXTREADING_DEBUG_ARTIFACTS", "false").lower() == "true"
+
+    def get_word_timings(self, audio_file):
+        '''
+        Returns the word timings of the recording as arrays: {"word": str, "start": float, "end": float}.
+        '''
+        if self.cache is None:
+            return self.transcribe(audio_file)
+
+        key = self.cache.get_key(audio_file)
+        word_timings = self.try_load_cached_word_timings(key, audio_file)
+        if word_timings is not None:
+            return word_timings
+
+        word_timings = self.transcribe(audio_file)
+        if word_timings is not None:
+            self.try_cache_word_timings(key, word_timings, audio_file)
+        return word_timings
+
+    def try_load_cached_word_timings(self, key, audio_file):
+        ## The entry can be evicted by another process while it is read: any failure is a cache miss, and the recording is transcribed
+        try:
+            csv_file = self.cache.get(key)
+            if csv_file is None:
+                return None
+            word_timings = self.load_word_timings(csv_file)
+        except (OSError, ValueError) as e: # ValueError: e.g., pandas' EmptyDataError and ParserError
+            print(f"Failed to read the cached transcript of {os.path.basename(audio_file)}: {str(e)}")
+            return None
+        print(f"Found cached transcript of {os.path.basename(audio_file)}")
+        return word_timings
+
+    def try_cache_word_timings(self, key, word_timings, audio_file):
+        ## Failing to cache the transcript (e.g., disk full) only means it will be transcribed again next time
+        tmp_csv_file = None
+        try:
+            with tempfile.NamedTemporaryFile("w", suffix=".csv", dir=self.data_dir, delete=False) as f:
+                tmp_csv_file = f.name
+            self.save_word_timings(word_timings, tmp_csv_file)
+            self.cache.put(key, tmp_csv_file)
+        except Exception as e:
+            print(f"Failed to cache the transcript of {os.path.basename(audio_file)}: {str(e)}")
+            if (tmp_csv_file is not None) and os.path.exists(tmp_csv_file):
+                os.remove(tmp_csv_file)
+
+    def get_all_word_timings(self, audio_files):
+        '''
+        Transcribes the recordings, n_workers of them at once. 
+        Returns their word timings in the same order as audio_files (None for the ones that failed).
+        '''
+        if self.n_workers <= 1:
+            return [ self.try_get_word_timings(audio_file) for audio_file in audio_files ]
+        else:
+            ## The transcription itself runs in other processes (Whisper worker or subprocess), threads just wait for it
+            with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+                return list(executor.map(self.try_get_word_timings, audio_files))
+
+    def try_get_word_timings(self, audio_file):
+        try:
+            return self.get_word_timings(audio_file)
+        except Exception as e:
+            print(f"Error processing audio file {audio_file}: {str(e)}")
+            return None
 
-    def generate_csv(self, audio_file):
+    def transcribe(self, audio_file):
+        ## Use the Whisper worker (see whisper_worker.py) if it is running, so the model is not reloaded for every file
+        try:
+            word_timings = self.transcribe_with_worker(audio_file)
+        except (FileNotFoundError, ConnectionRefusedError):
+            word_timings = self.transcribe_with_subprocess(audio_file)
+        except socket.timeout:
+            ## e.g., the worker is stuck or busy with other recordings
+            print(f"No answer from the Whisper worker within {self.worker_timeout}s, transcribing {os.path.basename(audio_file)} with get_speechrate.py")
+            word_timings = self.transcribe_with_subprocess(audio_file)
+        except (OSError, ValueError) as e:
+            ## e.g., the worker crashed or closed the connection in the middle of the request (ValueError: invalid response)
+            print(f"The Whisper worker failed ({str(e)}), transcribing {os.path.basename(audio_file)} with get_speechrate.py")
+            word_timings = self.transcribe_with_subprocess(audio_file)
+
+        if self.debug and (word_timings is not None):
+            self.save_word_timings(word_timings, str(audio_file).replace(".webm", "_ds.wav.words.csv"))
+        return word_timings
+
+    def transcribe_with_worker(self, audio_file):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.worker_timeout) # applies to connecting and to each read of the response
+            sock.connect(self.worker_socket_path)
+            request = {"audio_file": str(audio_file), "debug": self.debug}
+            sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            with sock.makefile("r", encoding="utf-8") as f:
+                line = f.readline()
+            if not line:
+                raise ConnectionResetError("connection closed by the Whisper worker without a response")
+            response = json.loads(line)
+
+        if "error" in response:
+            print(f"Error processing {audio_file}: {response['error']}")
+            return None
+        else:
+            print(f"Transcribed {os.path.basename(audio_file)} in {response['transcribe_time']:.2f}s (Whisper worker)")
+            return {
+                "word": np.array(response["word"], dtype=str), 
+                "start": np.array(response["start"], dtype=float), 
+                "end": np.array(response["end"], dtype=float)
+            }
+
+    def transcribe_with_subprocess(self, audio_file):
+        start = time.perf_counter()
         result = subprocess.run([
                 os.path.join(self.base_path, "whisper_venv", "bin", "python"), 
                 os.path.join(self.base_path, "whisper_venv", "get_speechrate.py"),
                 audio_file
             ],
             capture_output=True,
-            text=True
+            text=True,
+            env=self.get_subprocess_env()
         )
 
         if result.returncode != 0:
@@ -23,43 +150,83 @@ class TextReadingProcessor:
             return None
         
         # 構造正確的 .words.csv 路徑
-        csv_file = str(audio_file).replace(".webm", "_ds.wav.words.csv")
+        wav_file = str(audio_file).replace(".webm", "_ds.wav")
+        csv_file = f"{wav_file}.words.csv"
         if os.path.exists(csv_file):
-            return csv_file
+            print(f"Transcribed {os.path.basename(audio_file)} in {time.perf_counter() - start:.2f}s (including model loading)")
+            word_timings = self.load_word_timings(csv_file)
+            if not self.debug: # get_speechrate.py always writes its artifacts to disk
+                for file_path in [wav_file, csv_file]:
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+            return word_timings
         else:
             print(f"No .words.csv file generated for {audio_file}")
             return None
 
-    def calculate_mean_syllable_speech_rate(self, csv_files):
-        syllable_speech_rates = []
+    def load_word_timings(self, csv_file):
+        # 只讀取前三列，忽略多餘的列
+        df = pd.read_csv(csv_file, encoding='utf-8', usecols=[0, 1, 2], names=['word', 'start', 'end'])
+        return {
+            "word": df['word'].astype(str).to_numpy(dtype=str), 
+            "start": df['start'].to_numpy(dtype=float), 
+            "end": df['end'].to_numpy(dtype=float)
+        }
 
-        for csv_file in csv_files:
+    def save_word_timings(self, word_timings, csv_file):
+        pd.DataFrame(word_timings).to_csv(csv_file, header=False, index=False, encoding='utf-8')
+
+    def get_subprocess_env(self):
+        env = dict(os.environ)
+        if self.threads_per_worker:
+            env["OMP_NUM_THREADS"] = str(self.threads_per_worker)
+            env["MKL_NUM_THREADS"] = str(self.threads_per_worker)
+        return env
+
+    def calculate_syllable_speech_rates(self, word_timings_list):
+        '''
+        Returns the mean syllable speech rate (characters per second) of each file. 
+        Words without a positive duration are left out (instead of producing inf), 
+        a file without any valid word gets NaN.
+        '''
+        ## All the words of the subject in contiguous arrays, with the index of the file they come from
+        word_len = np.concatenate([ np.char.str_len(t["word"].astype(str)) for t in word_timings_list ]).astype(float)
+        duration = np.concatenate([ t["end"] - t["start"] for t in word_timings_list ])
+        file_idx = np.repeat(np.arange(len(word_timings_list)), [ len(t["word"]) for t in word_timings_list ])
+
+        valid = duration > 0 # also False for NaN
+        syllable_sr = word_len[valid] / duration[valid]
+        sr_sums = np.bincount(file_idx[valid], weights=syllable_sr, minlength=len(word_timings_list))
+        n_words = np.bincount(file_idx[valid], minlength=len(word_timings_list))
+        with np.errstate(invalid="ignore"):
+            return sr_sums / n_words
+
+    def calculate_mean_syllable_speech_rate(self, word_timings_list):
+        loaded = []
+        for word_timings in word_timings_list:
             try:
-                # 只讀取前三列，忽略多餘的列
-                df = pd.read_csv(csv_file, encoding='utf-8', usecols=[0, 1, 2], names=['word', 'start', 'end'])
-                
-                # 計算 syllable speech rate
-                df['duration'] = df['end'] - df['start']
-                df['word_len'] = df['word'].astype(str).apply(len)
-                df['syllable_sr'] = df['word_len'] / df['duration']
-                
-                # 計算該文件的平均 syllable speech rate
-                syllable_sr = df['syllable_sr'].mean()
-                syllable_speech_rates.append(syllable_sr)
+                ## Word timings, or the path of a .words.csv file
+                if isinstance(word_timings, str):
+                    word_timings = self.load_word_timings(word_timings)
+                loaded.append(word_timings)
             except Exception as e:
-                print(f"Failed to read or process {csv_file}: {e}")
+                print(f"Failed to read or process word timings: {e}")
 
-        if not syllable_speech_rates:
+        if not loaded:
             return None
 
         # 計算所有文件的平均 syllable speech rate
-        mean_syllable_sr = np.mean(syllable_speech_rates)
+        syllable_srs = self.calculate_syllable_speech_rates(loaded)
+        if np.isnan(syllable_srs).all():
+            return np.nan # no valid word in any file, recorded as missing (-999) by process_text_reading.py
+        ## Files without any valid word (e.g., an empty recording) are left out instead of making the mean NaN
+        mean_syllable_sr = np.nanmean(syllable_srs)
         return mean_syllable_sr
 
     def process_subject(self, subject_id):
         # 找到該受試者的所有音頻文件
         audio_files = [
-            f for f in os.listdir(self.input_path) 
+            f for f in sorted(os.listdir(self.data_dir)) 
             if f.startswith(subject_id) and f.endswith('.webm')
         ]
         
@@ -67,21 +234,16 @@ class TextReadingProcessor:
             print(f"No audio files found for subject {subject_id}")
             return None
 
-        csv_files = []
-        for audio_file in audio_files:
-            file_path = os.path.join(self.input_path, audio_file)
-            
-            # 生成 .words.csv 文件
-            csv_file = self.generate_csv(file_path)
-            if csv_file:
-                csv_files.append(csv_file)
-
-        if not csv_files:
-            print(f"No valid .words.csv files for subject {subject_id}")
+        # 取得每個音頻文件的 word timings
+        file_paths = [ os.path.join(self.data_dir, audio_file) for audio_file in audio_files ]
+        word_timings_list = [ t for t in self.get_all_word_timings(file_paths) if t is not None ]
+
+        if not word_timings_list:
+            print(f"No valid word timings for subject {subject_id}")
             return None
 
         # 計算平均 syllable speech rate
-        mean_speech_rate = self.calculate_mean_syllable_speech_rate(csv_files)
+        mean_speech_rate = self.calculate_mean_syllable_speech_rate(word_timings_list)
 
         if mean_speech_rate is None:
             print(f"No valid speech rate calculated for subject {subject_id}")
@@ -0,0 +1,57 @@
+import numpy as np
+
+def parse_numeric_lists(series):
+    '''
+    Parses a column of bracketed numeric lists (e.g., "[0.1, 0.25, 0.4]") in one pass,
+    into a flat float array and the offsets of each cell: cell i is values[offsets[i]:offsets[i + 1]].
+    '''
+    cells = series.astype(str).str.strip().str[1:-1]
+    lengths = np.where(cells.str.strip() == "", 0, cells.str.count(",") + 1)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    text = ",".join(cells[lengths > 0])
+    values = np.fromstring(text, sep=",") if text else np.empty(0)
+    if len(values) != offsets[-1]:
+        raise ValueError(f"Column '{series.name}' contains values that are not numeric lists")
+
+    return values, offsets
+
+class Trajectories:
+    '''
+    Mouse trajectories of all trials as ragged arrays: the samples of trial i are x[offsets[i]:offsets[i + 1]] (same for y and t).
+    '''
+    def __init__(self, x, y, t, offsets):
+        self.x = x
+        self.y = y
+        self.t = t
+        self.offsets = offsets
+
+    @classmethod
+    def from_columns(cls, x_series, y_series, t_series):
+        x, offsets = parse_numeric_lists(x_series)
+        y, y_offsets = parse_numeric_lists(y_series)
+        t, t_offsets = parse_numeric_lists(t_series)
+        if not (np.array_equal(offsets, y_offsets) and np.array_equal(offsets, t_offsets)):
+            raise ValueError("The x, y and time columns of the trajectories have different lengths")
+        return cls(x, y, t, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get_trial(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.x[start:end], self.y[start:end], self.t[start:end]
+
+    def first(self, values):
+        return self.take(values, self.offsets[:-1])
+
+    def last(self, values):
+        return self.take(values, self.offsets[1:] - 1)
+
+    def take(self, values, indices):
+        ## One value per trial, NaN for the trials without samples (whose index would point into a neighbouring trial)
+        has_samples = np.diff(self.offsets) > 0
+        result = np.full(len(self), np.nan)
+        result[has_samples] = values[indices[has_samples]]
+        return result
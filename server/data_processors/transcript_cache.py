@@ -0,0 +1,83 @@
+import os
+import time
+import shutil
+import hashlib
+
+class TranscriptCache:
+    '''
+    Keeps the Whisper artifacts of each recording (the word-timing CSV, and the downsampled WAV if any) under
+    <cache_dir>/<model_version>/<sha256 of the audio file>/, so that a recording that has already been
+    transcribed with the same model is not transcribed again.
+    Entries not used for max_age_days are evicted, then the least recently used ones until the cache fits in max_size_mb.
+    '''
+    def __init__(self, cache_dir, model_version, max_age_days=90, max_size_mb=2048):
+        self.cache_dir = cache_dir
+        self.model_version = model_version
+        self.max_age_days = max_age_days
+        self.max_size_mb = max_size_mb
+
+    def get_key(self, audio_file):
+        sha256 = hashlib.sha256()
+        with open(audio_file, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def get_entry_dir(self, key):
+        return os.path.join(self.cache_dir, self.model_version, key)
+
+    def get(self, key):
+        '''
+        Returns the cached word CSV, or None on a miss.
+        '''
+        entry_dir = self.get_entry_dir(key)
+        csv_file = os.path.join(entry_dir, "words.csv")
+        if not os.path.exists(csv_file):
+            return None
+        try:
+            os.utime(entry_dir) # marks the entry as recently used
+        except OSError:
+            return None # evicted by another process in the meantime
+        return csv_file
+
+    def put(self, key, csv_file, wav_file=None):
+        '''
+        Moves the artifacts of a transcription into the cache and returns the cached word CSV.
+        '''
+        entry_dir = self.get_entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+        if (wav_file is not None) and os.path.exists(wav_file):
+            shutil.move(wav_file, os.path.join(entry_dir, "ds.wav"))
+        cached_csv_file = os.path.join(entry_dir, "words.csv")
+        shutil.move(csv_file, cached_csv_file)
+        self.evict()
+        return cached_csv_file
+
+    def get_size(self, entry_dir):
+        return sum([ entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file() ])
+
+    def evict(self):
+        if not os.path.exists(self.cache_dir):
+            return 0
+        entries = [] # (last used, size, path)
+        for model_entry in os.scandir(self.cache_dir):
+            if model_entry.is_dir():
+                for entry in os.scandir(model_entry.path):
+                    if not entry.is_dir():
+                        continue
+                    try:
+                        entries.append((entry.stat().st_mtime, self.get_size(entry.path), entry.path))
+                    except FileNotFoundError:
+                        continue # evicted by another process in the meantime
+        entries.sort()
+
+        n_evicted = 0
+        max_age = self.max_age_days * 24 * 60 * 60
+        total_size = sum([ size for _, size, _ in entries ])
+        for last_used, size, entry_dir in entries:
+            if (time.time() - last_used < max_age) and (total_size <= self.max_size_mb * 1024 * 1024):
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= size
+            n_evicted += 1
+        return n_evicted
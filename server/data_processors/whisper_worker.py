@@ -0,0 +1,171 @@
+#!/usr/bin/python
+
+# Long-lived Whisper transcription worker, run with the Python of whisper_venv:
+# whisper_venv/bin/python whisper_worker.py [--socket <path>] [--workers <n>] [--threads <n>]
+#
+# With --workers > 1, the listening socket is shared by pre-forked processes, each with its own model,
+# so that several recordings are transcribed at once (each with --threads CPU threads).
+#
+# Loads the model once and serves requests over a Unix socket, one JSON object per line:
+#   {"audio_file": "<path>.webm"} -> {"word": [...], "start": [...], "end": [...], "transcribe_time": <seconds>}
+#   {"cmd": "ping"}               -> {"model": "<name>", "load_time": <seconds>}
+# Errors are answered with {"error": "<message>"}.
+# The recordings are decoded in memory; with "debug": true, the downsampled <path>_ds.wav and
+# its <path>_ds.wav.words.csv (word, start, end; no header, as get_speechrate.py) are also written.
+
+import os
+import csv
+import json
+import time
+import argparse
+import subprocess
+import signal
+import wave
+import numpy as np
+import socketserver
+
+SAMPLE_RATE = 16000
+DEFAULT_SOCKET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "whisper_worker.sock")
+
+class Transcriber:
+    def __init__(self, model_name, language, device="cpu", n_threads=None):
+        self.model_name = model_name
+        self.language = language
+
+        start = time.perf_counter()
+        if n_threads:
+            import torch
+            torch.set_num_threads(n_threads)
+        try:
+            import whisper_timestamped as whisper
+            self.timestamped = True
+        except ImportError:
+            import whisper
+            self.timestamped = False
+        self.whisper = whisper
+        self.model = whisper.load_model(model_name, device=device)
+        self.load_time = time.perf_counter() - start
+
+    def decode(self, audio_file):
+        ## 16 kHz mono PCM, as expected by Whisper, piped from ffmpeg instead of written to disk
+        result = subprocess.run(
+            ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", audio_file, "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-"],
+            capture_output=True, 
+            check=True
+        )
+        return np.frombuffer(result.stdout, np.int16).astype(np.float32) / 32768.0
+
+    def save_wav(self, audio, wav_file):
+        with wave.open(wav_file, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes((audio * 32768.0).astype(np.int16).tobytes())
+
+    def get_words(self, audio):
+        if self.timestamped:
+            result = self.whisper.transcribe(self.model, audio, language=self.language)
+            text_key = "text"
+        else:
+            result = self.model.transcribe(audio, language=self.language, word_timestamps=True)
+            text_key = "word"
+        return [
+            (word[text_key].strip(), word["start"], word["end"])
+            for segment in result["segments"] for word in segment.get("words", [])
+        ]
+
+    def transcribe(self, audio_file, debug=False):
+        '''
+        Returns the word timings of the recording as three lists (word, start, end).
+        '''
+        start = time.perf_counter()
+        audio = self.decode(audio_file)
+        words = self.get_words(audio)
+
+        if debug:
+            wav_file = str(audio_file).replace(".webm", "_ds.wav")
+            self.save_wav(audio, wav_file)
+            with open(f"{wav_file}.words.csv", "w", encoding="utf-8", newline="") as f:
+                csv.writer(f).writerows(words)
+
+        word_timings = {
+            "word": [ w for w, _, _ in words ], 
+            "start": [ s for _, s, _ in words ], 
+            "end": [ e for _, _, e in words ]
+        }
+        return word_timings, time.perf_counter() - start
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+                if message.get("cmd") == "ping":
+                    response = {
+                        "model": self.server.transcriber.model_name,
+                        "load_time": self.server.transcriber.load_time
+                    }
+                else:
+                    word_timings, transcribe_time = self.server.transcriber.transcribe(
+                        message["audio_file"], debug=message.get("debug", False)
+                    )
+                    print(f"Transcribed {message['audio_file']} in {transcribe_time:.2f}s", flush=True)
+                    response = {**word_timings, "transcribe_time": transcribe_time}
+            except Exception as e:
+                response = {"error": str(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+class WorkerServer(socketserver.UnixStreamServer):
+    ## Each process serves its requests one at a time, the model is not shared between threads
+    def __init__(self, socket_path):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.transcriber = None
+        super().__init__(socket_path, RequestHandler)
+
+def serve(server, args):
+    server.transcriber = Transcriber(args.model, args.language, n_threads=args.threads)
+    print(f"[{os.getpid()}] Loaded Whisper model '{args.model}' in {server.transcriber.load_time:.2f}s", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+def handle_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
+## ====================================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Whisper transcription worker")
+    parser.add_argument("--socket", default=os.getenv("WHISPER_WORKER_SOCKET", DEFAULT_SOCKET_PATH))
+    parser.add_argument("--model", default=os.getenv("WHISPER_MODEL", "small"))
+    parser.add_argument("--language", default=os.getenv("WHISPER_LANGUAGE", "zh"))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WHISPER_WORKERS", 1)))
+    parser.add_argument("--threads", type=int, default=int(os.getenv("WHISPER_THREADS_PER_WORKER", 0)) or None)
+    args = parser.parse_args()
+    signal.signal(signal.SIGTERM, handle_sigterm) # stop the forked workers as well
+
+    with WorkerServer(args.socket) as server:
+        print(f"Listening on {args.socket} with {args.workers} workers", flush=True)
+        if args.workers <= 1:
+            serve(server, args)
+        else:
+            ## Fork before loading the model, every child accepts connections on the same socket
+            pids = []
+            for _ in range(args.workers):
+                pid = os.fork()
+                if pid == 0:
+                    serve(server, args)
+                    os._exit(0)
+                pids.append(pid)
+            try:
+                for pid in pids:
+                    os.waitpid(pid, 0)
+            except KeyboardInterrupt:
+                for pid in pids:
+                    os.kill(pid, signal.SIGTERM)
+                for pid in pids:
+                    os.waitpid(pid, 0)
+        os.remove(args.socket)
@@ -3,7 +3,7 @@
 import os
 import glob
 import logging
-import requests
+from http_client import get_client
 import pandas as pd
 from dotenv import load_dotenv
 
@@ -20,7 +20,7 @@ class Config:
         self.data_dir = os.path.join(self.source_dir, "..", "data", self.experiment_name)
 
 def get_uploaded_not_downloaded(not_downloaded_tokens, config, logger):
-    res = requests.get(
+    res = get_client().get(
         url=config.exp_media_url, 
         headers=config.gitlab_header
     )
@@ -41,7 +41,7 @@ def get_uploaded_not_downloaded(not_downloaded_tokens, config, logger):
         return []
 
 def update_is_file_ready(csv_filename, is_file_ready, logger):
-    res = requests.get(
+    res = get_client().get(
         url=f"https://qoca-api.chih-he.dev/tasks?csv_filename={csv_filename}"
     )
     if res.status_code == 200:
@@ -52,7 +52,7 @@ def update_is_file_ready(csv_filename, is_file_ready, logger):
             status = json_data['items'][0]['status']
 
             if status == 0: # report is not generated yet 
-                res = requests.put(
+                res = get_client().put(
                     url=f"https://qoca-api.chih-he.dev/tasks/{task_id}", 
                     json={
                         "is_file_ready": is_file_ready
@@ -100,7 +100,7 @@ if __name__ == "__main__":
     csv_ready_marked_subjs = []
     if len(urls_to_download) > 0:
         for file_url in urls_to_download:
-            res = requests.get(file_url, stream=True)
+            res = get_client().get(file_url, stream=True)
 
             if res.status_code == 200:
                 file_name = os.path.basename(file_url)
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+# Exports the integrated results of all participants as one (participants x PLATFORM_FEATURES) matrix, e.g., to retrain the models:
+# python export_cohort.py [--export_dir <dir>] [--full]
+#
+# Writes <export_dir>/features.npy (float64, missing values as NaN; can be opened with np.load(..., mmap_mode="r"))
+# and <export_dir>/index.json (the participant of each row, the feature of each column, and the time of the export).
+# Only the participants updated since the previous export are read again, unless --full is given.
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+
+import util
+from feature_store import open_feature_store
+
+class Config:
+    def __init__(self):
+        self.source_dir = os.path.dirname(os.path.abspath(__file__))
+        self.integrated_results_dir = os.path.join(self.source_dir, "integrated_results")
+        self.export_dir = os.path.join(self.source_dir, "exports")
+        self.platform_features = util.init_platform_features()
+        self.missing_marker = -999
+
+def load_export(export_dir):
+    '''
+    Returns the participant IDs, the feature names and the (memory-mapped) matrix of the last export, or None if there is none.
+    '''
+    index_path = os.path.join(export_dir, "index.json")
+    matrix_path = os.path.join(export_dir, "features.npy")
+    if not (os.path.exists(index_path) and os.path.exists(matrix_path)):
+        return None
+    with open(index_path, "r") as f:
+        index = json.load(f)
+    matrix = np.load(matrix_path, mmap_mode="r")
+    return index["subject_ids"], index["features"], matrix, index["exported_at"]
+
+def save_export(export_dir, subject_ids, features, matrix, exported_at):
+    ## The matrix first, then the index, each written to a temporary file and renamed
+    os.makedirs(export_dir, exist_ok=True)
+    tmp_matrix_path = os.path.join(export_dir, "features.tmp.npy")
+    np.save(tmp_matrix_path, matrix)
+    os.replace(tmp_matrix_path, os.path.join(export_dir, "features.npy"))
+
+    tmp_index_path = os.path.join(export_dir, "index.tmp.json")
+    with open(tmp_index_path, "w") as f:
+        json.dump({ "subject_ids": subject_ids, "features": features, "exported_at": exported_at }, f)
+    os.replace(tmp_index_path, os.path.join(export_dir, "index.json"))
+
+def export_cohort(feature_store, config, full=False):
+    started_at = time.time() # participants updated during the export are read again next time
+    subject_ids = feature_store.list_subjects()
+    features = config.platform_features
+
+    previous = None if full else load_export(config.export_dir)
+    if (previous is not None) and (previous[1] != features):
+        print("The platform features have changed since the previous export, exporting all participants")
+        previous = None
+
+    matrix = np.full((len(subject_ids), len(features)), np.nan)
+    if previous is None:
+        to_read = subject_ids
+    else:
+        previous_subject_ids, _, previous_matrix, exported_at = previous
+        previous_rows = { subject_id: i for i, subject_id in enumerate(previous_subject_ids) }
+        updated = set(feature_store.list_subjects(updated_since=exported_at))
+        to_read = [ s for s in subject_ids if (s in updated) or (s not in previous_rows) ]
+        kept = [ (i, previous_rows[s]) for i, s in enumerate(subject_ids) if (s not in updated) and (s in previous_rows) ]
+        if kept:
+            rows, source_rows = map(list, zip(*kept))
+            matrix[rows] = previous_matrix[source_rows]
+
+    if to_read:
+        to_read_set = set(to_read)
+        rows = [ i for i, s in enumerate(subject_ids) if s in to_read_set ]
+        matrix[rows] = feature_store.read_matrix(to_read, features, missing_marker=config.missing_marker)
+
+    save_export(config.export_dir, subject_ids, features, matrix, started_at)
+    return len(subject_ids), len(to_read)
+
+## ====================================================================================
+
+if __name__ == "__main__":
+    load_dotenv()
+    config = Config()
+
+    parser = argparse.ArgumentParser(description="Export the integrated results of all participants as one matrix")
+    parser.add_argument("--export_dir", default=config.export_dir)
+    parser.add_argument("--full", action="store_true", help="read all participants again")
+    args = parser.parse_args()
+    config.export_dir = args.export_dir
+
+    feature_store = open_feature_store(config.integrated_results_dir)
+    n_subjects, n_read = export_cohort(feature_store, config, full=args.full)
+    print(f"Exported {n_subjects} participants to {config.export_dir} ({n_read} read from the feature store)")
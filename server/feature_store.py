@@ -0,0 +1,289 @@
+#!/usr/bin/python
+
+import os
+import glob
+import json
+import time
+import fcntl
+import sqlite3
+import tempfile
+import threading
+import numpy as np
+from contextlib import closing, contextmanager
+
+def to_builtin(obj):
+    ## NumPy values (e.g., taken from the processors' DataFrames) as plain Python ones, for json.dump
+    if isinstance(obj, np.generic):
+        return obj.item()
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class FeatureStore:
+    '''
+    Access to the participants' integrated results (<SUBJECT_ID>_integrated_result.json),
+    shared by the services that need them (predict.py, get_integrated_result.py) so they can read
+    the files directly instead of going through the /get_integrated_result endpoint.
+    Parsed files are cached in memory and re-read only when their modification time or size changes.
+    Updates (server.py, process_text_reading.py) hold a per-subject file lock for the whole read-merge-write, 
+    and replace the file atomically, so that concurrent updates are not lost and readers never see a partial file.
+    '''
+    def __init__(self, integrated_results_dir):
+        self.integrated_results_dir = integrated_results_dir
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get_path(self, subject_id):
+        return os.path.join(self.integrated_results_dir, f"{subject_id}_integrated_result.json")
+
+    def get_lock_path(self, subject_id):
+        return os.path.join(self.integrated_results_dir, ".locks", f"{subject_id}.lock")
+
+    def exists(self, subject_id):
+        return os.path.exists(self.get_path(subject_id))
+
+    def list_subjects(self, updated_since=None):
+        ## Participants with an integrated result (updated since updated_since, a timestamp, if given)
+        suffix = "_integrated_result.json"
+        return [
+            os.path.basename(path)[:-len(suffix)] 
+            for path in sorted(glob.glob(os.path.join(self.integrated_results_dir, f"*{suffix}")))
+            if (updated_since is None) or (os.path.getmtime(path) >= updated_since)
+        ]
+
+    def read(self, subject_id):
+        '''
+        Returns a copy of the integrated result of the participant.
+        Raises FileNotFoundError if it does not exist.
+        '''
+        json_file_path = self.get_path(subject_id)
+        stat = os.stat(json_file_path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+
+        cached = self._cache.get(subject_id)
+        if (cached is None) or (cached[0] != stamp):
+            with open(json_file_path, "r") as f:
+                integrated_result = json.load(f)
+            cached = (stamp, integrated_result)
+            with self._lock:
+                self._cache[subject_id] = cached
+
+        return dict(cached[1])
+
+    def read_matrix(self, subject_ids, features, missing_marker=-999, fill_value=np.nan):
+        '''
+        Returns a (subjects x features) float array, in the order of the arguments;
+        missing features (not stored, or stored as missing_marker) are set to fill_value.
+        '''
+        matrix = np.full((len(subject_ids), len(features)), fill_value, dtype=float)
+        for i, subject_id in enumerate(subject_ids):
+            if not self.exists(subject_id):
+                continue
+            integrated_result = self.read(subject_id)
+            for j, feature in enumerate(features):
+                value = integrated_result.get(feature)
+                if (value is not None) and (value != missing_marker):
+                    matrix[i, j] = value
+        return matrix
+
+    @contextmanager
+    def lock(self, subject_id):
+        ## flock: held across processes, and across threads since each call opens its own file
+        lock_path = self.get_lock_path(subject_id)
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def write(self, subject_id, integrated_result, default=None):
+        ## Written to a temporary file in the same directory, then renamed over the previous one
+        json_file_path = self.get_path(subject_id)
+        fd, tmp_path = tempfile.mkstemp(dir=self.integrated_results_dir, prefix=f".{subject_id}_", suffix=".tmp")
+        try:
+            os.chmod(tmp_path, 0o644) # as the files written with open()
+            with os.fdopen(fd, "w") as f:
+                json.dump(integrated_result, f, separators=(",", ":"), default=default or to_builtin)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, json_file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def update(self, subject_id, features, missing_marker, default=None):
+        '''
+        Merges the features into the integrated result of the participant (created with all features missing if needed): 
+        values other than missing_marker overwrite the stored ones, missing ones never do.
+        Returns the merged result.
+        '''
+        os.makedirs(self.integrated_results_dir, exist_ok=True)
+        with self.lock(subject_id):
+            json_file_path = self.get_path(subject_id)
+            if os.path.exists(json_file_path):
+                with open(json_file_path, "r") as f:
+                    integrated_result = json.load(f)
+            else:
+                integrated_result = {}
+
+            for key, value in features.items():
+                if value != missing_marker:
+                    integrated_result[key] = value
+                elif key not in integrated_result:
+                    integrated_result[key] = missing_marker
+
+            self.write(subject_id, integrated_result, default=default)
+        return integrated_result
+
+    def invalidate(self, subject_id=None):
+        with self._lock:
+            if subject_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(subject_id, None)
+
+class SQLiteFeatureStore:
+    '''
+    Same interface as FeatureStore, backed by a local SQLite file (WAL mode) with one row per participant and feature,
+    so that cohort-level operations (exports, rescoring) can read all participants with a single query (see read_matrix()).
+    One row per feature rather than one column: the integrated results also hold features that are not platform features,
+    and the feature set changes over time (new tasks, renamed features), which would otherwise need an ALTER TABLE for every new name;
+    read_matrix() turns the rows into the subjects x features matrix instead.
+    Enabled with FEATURE_STORE_BACKEND=sqlite; migrate_feature_store.py copies the existing JSON files into it.
+    '''
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.init_db()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_db(self):
+        db_dir = os.path.dirname(os.path.abspath(self.db_path))
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        with closing(self.connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS subjects (
+                    subject_id TEXT PRIMARY KEY,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS features (
+                    subject_id TEXT NOT NULL,
+                    feature TEXT NOT NULL,
+                    value,
+                    UNIQUE (subject_id, feature)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_subjects_updated_at ON subjects (updated_at)")
+
+    def exists(self, subject_id):
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT 1 FROM subjects WHERE subject_id = ?", (subject_id,)).fetchone()
+        return row is not None
+
+    def list_subjects(self, updated_since=None):
+        with closing(self.connect()) as conn:
+            rows = conn.execute(
+                "SELECT subject_id FROM subjects WHERE updated_at >= ? ORDER BY subject_id", 
+                (-1 if updated_since is None else updated_since,)
+            ).fetchall()
+        return [ row["subject_id"] for row in rows ]
+
+    def read(self, subject_id):
+        '''
+        Returns the integrated result of the participant, with the features in the order they were first stored.
+        Raises FileNotFoundError if it does not exist (as FeatureStore).
+        '''
+        with closing(self.connect()) as conn:
+            rows = conn.execute(
+                "SELECT feature, value FROM features WHERE subject_id = ? ORDER BY rowid", (subject_id,)
+            ).fetchall()
+        if not rows:
+            raise FileNotFoundError(f"No integrated result for subject ID: {subject_id}")
+        return { row["feature"]: row["value"] for row in rows }
+
+    def read_matrix(self, subject_ids, features, missing_marker=-999, fill_value=np.nan):
+        '''
+        Returns a (subjects x features) float array, in the order of the arguments;
+        missing features (not stored, or stored as missing_marker) are set to fill_value.
+        '''
+        subject_index = { subject_id: i for i, subject_id in enumerate(subject_ids) }
+        feature_index = { feature: j for j, feature in enumerate(features) }
+        matrix = np.full((len(subject_index), len(feature_index)), fill_value, dtype=float)
+
+        with closing(self.connect()) as conn:
+            conn.execute("CREATE TEMP TABLE selected (subject_id TEXT PRIMARY KEY)")
+            conn.executemany("INSERT OR IGNORE INTO selected VALUES (?)", [ (s,) for s in subject_index ])
+            rows = conn.execute("""
+                SELECT f.subject_id, f.feature, f.value FROM features AS f 
+                JOIN selected AS s ON f.subject_id = s.subject_id
+                WHERE f.value IS NOT NULL AND f.value != ?
+            """, (missing_marker,)).fetchall()
+
+        for subject_id, feature, value in rows:
+            j = feature_index.get(feature)
+            if j is not None:
+                matrix[subject_index[subject_id], j] = value
+        return matrix
+
+    def update(self, subject_id, features, missing_marker, default=None, updated_at=None):
+        '''
+        Merges the features into the integrated result of the participant, as FeatureStore.update():
+        values other than missing_marker overwrite the stored ones, missing ones never do.
+        Returns the merged result.
+        '''
+        values = []
+        for key, value in features.items():
+            if isinstance(value, np.generic):
+                value = value.item()
+            elif (default is not None) and not isinstance(value, (int, float, str, type(None))):
+                value = default(value)
+            values.append((subject_id, key, value))
+
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            ## IS NOT rather than !=, which is NULL (false) when the new value is None, so that None overwrites as in FeatureStore.update()
+            conn.executemany("""
+                INSERT INTO features (subject_id, feature, value) VALUES (?, ?, ?)
+                ON CONFLICT (subject_id, feature) DO UPDATE SET value = excluded.value WHERE excluded.value IS NOT ?
+            """, [ (*row, missing_marker) for row in values ])
+            conn.execute("""
+                INSERT INTO subjects (subject_id, updated_at) VALUES (?, ?)
+                ON CONFLICT (subject_id) DO UPDATE SET updated_at = excluded.updated_at
+            """, (subject_id, time.time() if updated_at is None else updated_at))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        return self.read(subject_id)
+
+    def invalidate(self, subject_id=None):
+        pass # nothing cached
+
+def open_feature_store(integrated_results_dir):
+    '''
+    Returns the feature store selected by FEATURE_STORE_BACKEND: "json" (default, one file per participant) or "sqlite".
+    '''
+    backend = os.getenv("FEATURE_STORE_BACKEND", "json")
+    if backend == "sqlite":
+        return SQLiteFeatureStore(os.getenv(
+            "FEATURE_STORE_DB_PATH", os.path.join(integrated_results_dir, "integrated_results.sqlite3")
+        ))
+    elif backend == "json":
+        return FeatureStore(integrated_results_dir)
+    else:
+        raise ValueError(f"Unknown FEATURE_STORE_BACKEND: {backend}")
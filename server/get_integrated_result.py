@@ -5,9 +5,9 @@ from pydantic import BaseModel
 import uvicorn
 import os
 import logging
-import json
 from dotenv import load_dotenv
-from server import authenticate_gitlab
+from server_common import authenticate_gitlab
+from feature_store import open_feature_store
 
 class Config:
     def __init__(self):
@@ -21,6 +21,7 @@ class SubjectDownloadRequest(BaseModel):
 
 load_dotenv()
 config = Config()
+feature_store = open_feature_store(config.integrated_results_dir)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)  
@@ -31,13 +32,11 @@ app = FastAPI(docs_url=None)
 async def get_integrated_result(request: SubjectDownloadRequest, token: str = Depends(authenticate_gitlab)):
     subject_id = request.subject_id
     logger.info(f"Received request to get integrated result for subject ID: {subject_id}")
-    json_file_path = os.path.join(config.integrated_results_dir, f"{subject_id}_integrated_result.json")
 
-    if not os.path.exists(json_file_path):
+    if not feature_store.exists(subject_id):
         raise HTTPException(status_code=404, detail=f"Integrated result file not found for subject ID: {subject_id}")
     else:
-        with open(json_file_path, "r") as f:
-            integrated_result = json.load(f)
+        integrated_result = feature_store.read(subject_id)
         return {"status": "ok", "integrated_result": integrated_result}
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+
+import os
+import re
+import time
+import random
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+class HttpClient:
+    '''
+    Shared HTTP client for the calls to qoca-api, GitLab, Pavlovia and the local services.
+    Keeps one requests.Session (i.e., a pool of keep-alive connections) per host, applies default timeouts,
+    retries idempotent requests with jittered exponential backoff on 5xx responses and connection errors,
+    and records the latency of each endpoint (see metrics()).
+    POST requests are only retried when the caller passes retry=True, since most of them are not idempotent.
+    '''
+    def __init__(self, connect_timeout=5, read_timeout=60, max_retries=3, backoff_base=0.5, backoff_max=8, pool_maxsize=10, logger=None):
+        self.timeout = (connect_timeout, read_timeout) # seconds
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base # seconds
+        self.backoff_max = backoff_max # seconds
+        self.pool_maxsize = pool_maxsize
+        self.logger = logger or logging.getLogger(__name__)
+        self._sessions = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def get_session(self, url):
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        session = self._sessions.get(host)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(host)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                    session.mount(host, adapter)
+                    self._sessions[host] = session
+        return session
+
+    def get_endpoint(self, method, url):
+        ## Group the URLs by path, with the IDs (e.g., /user/<id_card>, /tasks/<task_id>) left out
+        parts = urlsplit(url)
+        segments = [ "{id}" if re.search(r"\d", seg) else seg for seg in parts.path.split("/") ]
+        return f"{method} {parts.netloc}{'/'.join(segments)}"
+
+    def get_backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_base * (2 ** attempt), self.backoff_max))
+
+    def request(self, method, url, retry=None, endpoint=None, **kwargs):
+        method = method.upper()
+        if retry is None:
+            retry = method in IDEMPOTENT_METHODS
+        max_retries = self.max_retries if retry else 0
+        endpoint = endpoint or self.get_endpoint(method, url)
+        kwargs.setdefault("timeout", self.timeout)
+        session = self.get_session(url)
+
+        for attempt in range(max_retries + 1):
+            start = time.perf_counter()
+            try:
+                res = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.record(endpoint, time.perf_counter() - start, error=True, retried=(attempt > 0))
+                if attempt >= max_retries:
+                    raise
+                self.logger.warning(f"{endpoint} failed ({type(e).__name__}), retrying ({attempt + 1}/{max_retries})")
+            else:
+                self.record(endpoint, time.perf_counter() - start, error=(res.status_code >= 500), retried=(attempt > 0))
+                if (res.status_code not in RETRY_STATUS_CODES) or (attempt >= max_retries):
+                    return res
+                self.logger.warning(f"{endpoint} returned {res.status_code}, retrying ({attempt + 1}/{max_retries})")
+                res.close()
+            time.sleep(self.get_backoff(attempt))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def record(self, endpoint, elapsed, error=False, retried=False):
+        with self._lock:
+            stats = self._metrics.setdefault(endpoint, {
+                "count": 0, "errors": 0, "retries": 0, "total_time": 0.0, "max_time": 0.0
+            })
+            stats["count"] += 1
+            stats["errors"] += int(error)
+            stats["retries"] += int(retried)
+            stats["total_time"] += elapsed
+            stats["max_time"] = max(stats["max_time"], elapsed)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                endpoint: {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "retries": stats["retries"],
+                    "mean_time": round(stats["total_time"] / stats["count"], 4),
+                    "max_time": round(stats["max_time"], 4)
+                } for endpoint, stats in self._metrics.items()
+            }
+
+    def log_metrics(self):
+        for endpoint, stats in self.metrics().items():
+            self.logger.info(f"{endpoint}: {stats}")
+
+## ====================================================================================
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    '''
+    Returns the process-wide HttpClient, created on first use so that the settings in .env are already loaded.
+    '''
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HttpClient(
+                    connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", 5)),
+                    read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", 60)),
+                    max_retries=int(os.getenv("HTTP_MAX_RETRIES", 3))
+                )
+    return _client
@@ -0,0 +1,245 @@
+#!/usr/bin/python
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+import traceback
+from contextlib import closing
+
+class JobQueue:
+    '''
+    Durable job queue backed by a local SQLite file, so that queued work survives a restart of the server.
+    A job runs through a list of stages (e.g., ["fetch", "process"]); each stage is retried with
+    exponential backoff until it succeeds or max_attempts is reached.
+    '''
+    def __init__(self, db_path, max_attempts=5, backoff_base=10, backoff_max=600):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base # seconds
+        self.backoff_max = backoff_max # seconds
+        self._changed = threading.Condition() # wakes up idle workers when a job becomes ready
+        self.init_db()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_db(self):
+        db_dir = os.path.dirname(os.path.abspath(self.db_path))
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        with closing(self.connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    subject_id TEXT,
+                    payload TEXT NOT NULL,
+                    stages TEXT NOT NULL,
+                    stage_index INTEGER NOT NULL DEFAULT 0,
+                    stage TEXT,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    next_run_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, stage, next_run_at)")
+
+    def enqueue(self, kind, payload, stages, subject_id=None):
+        now = time.time()
+        with closing(self.connect()) as conn:
+            cur = conn.execute(
+                "INSERT INTO jobs (kind, subject_id, payload, stages, stage, next_run_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, subject_id, json.dumps(payload), json.dumps(stages), stages[0], now, now, now)
+            )
+        self.notify_change()
+        return cur.lastrowid
+
+    def claim(self, stages, exclusive=False):
+        '''
+        Marks the oldest due job whose current stage is one of the given stages as running and returns it, 
+        or returns None if there is nothing to do. 
+        If exclusive, a job is not claimed while another job of the same subject is running one of these stages.
+        '''
+        now = time.time()
+        placeholders = ",".join(["?"] * len(stages))
+        query = f"""
+            SELECT * FROM jobs
+            WHERE status = 'queued' AND next_run_at <= ? AND stage IN ({placeholders})
+        """
+        params = [now] + list(stages)
+        if exclusive:
+            query += f"""
+            AND (subject_id IS NULL OR subject_id NOT IN (
+                SELECT subject_id FROM jobs 
+                WHERE status = 'running' AND subject_id IS NOT NULL AND stage IN ({placeholders})
+            ))
+            """
+            params += list(stages)
+        query += " ORDER BY next_run_at, id LIMIT 1"
+
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(query, params).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?", (now, row["id"])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        return None if row is None else self.to_dict(row)
+
+    def advance(self, job_id, payload):
+        '''
+        Saves the payload returned by the current stage and moves the job to its next stage (or marks it done).
+        '''
+        now = time.time()
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT stages, stage_index FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            stages = json.loads(row["stages"])
+            stage_index = row["stage_index"] + 1
+            if stage_index >= len(stages):
+                status, stage = "done", None
+            else:
+                status, stage = "queued", stages[stage_index]
+            conn.execute(
+                "UPDATE jobs SET payload = ?, stage_index = ?, stage = ?, status = ?, attempts = 0, error = NULL, next_run_at = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(payload), stage_index, stage, status, now, now, job_id)
+            )
+        self.notify_change()
+        return status
+
+    def retry(self, job_id, error, retryable=True):
+        '''
+        Schedules the current stage of the job to run again after a backoff, or marks the job failed 
+        (after max_attempts, or at once if not retryable).
+        '''
+        now = time.time()
+        with closing(self.connect()) as conn:
+            attempts = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()["attempts"] + 1
+            if (not retryable) or (attempts >= self.max_attempts):
+                status = "failed"
+                next_run_at = now
+            else:
+                status = "queued"
+                next_run_at = now + min(self.backoff_base * (2 ** (attempts - 1)), self.backoff_max)
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = ?, error = ?, next_run_at = ?, updated_at = ? WHERE id = ?",
+                (status, attempts, error, next_run_at, now, job_id)
+            )
+        return status
+
+    def requeue_running(self):
+        '''
+        Puts back the jobs that were left running (e.g., when the server was killed in the middle of a stage).
+        '''
+        now = time.time()
+        with closing(self.connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'queued', next_run_at = ?, updated_at = ? WHERE status = 'running'", (now, now)
+            )
+        self.notify_change()
+        return cur.rowcount
+
+    def notify_change(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def wait_for_change(self, timeout):
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def get(self, job_id):
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if row is None else self.to_dict(row)
+
+    def to_dict(self, row):
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["stages"] = json.loads(job["stages"])
+        return job
+
+class JobWorkerPool:
+    '''
+    Threads that take jobs from a JobQueue and run their current stage with the matching handler.
+    A handler receives the job payload and returns the (updated) payload for the next stage.
+    Each pool only claims the stages it has handlers for, so that e.g. I/O-bound and CPU-bound stages 
+    can be given separate pools; an exclusive pool never runs two jobs of the same subject at once.
+    A failed stage is not retried if it is one of non_retryable_stages (e.g., it is not idempotent) or if it failed with a client error (4xx).
+    '''
+    def __init__(self, queue, handlers, n_workers=2, exclusive=False, poll_interval=1.0, name="job", logger=None, non_retryable_stages=None):
+        self.queue = queue
+        self.handlers = handlers
+        self.stages = list(handlers.keys())
+        self.non_retryable_stages = set(non_retryable_stages or [])
+        self.n_workers = n_workers
+        self.exclusive = exclusive
+        self.name = name
+        self.poll_interval = poll_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.n_workers):
+            thread = threading.Thread(target=self.work, name=f"{self.name}-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self.queue.notify_change()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def work(self):
+        while not self._stopping.is_set():
+            job = self.queue.claim(self.stages, exclusive=self.exclusive)
+            if job is None:
+                self.queue.wait_for_change(self.poll_interval)
+                continue
+            self.run_stage(job)
+            self.queue.notify_change() # a job of the same subject may be ready now
+
+    def run_stage(self, job):
+        job_id, stage = job["id"], job["stage"]
+        try:
+            start = time.perf_counter()
+            payload = self.handlers[stage](job["payload"])
+            status = self.queue.advance(job_id, payload)
+            self.logger.info(f"Job #{job_id}: stage '{stage}' finished in {time.perf_counter() - start:.2f}s ({status})")
+        except Exception as e:
+            self.logger.error(f"Job #{job_id}: stage '{stage}' failed: {str(e)}\n{traceback.format_exc()}")
+            retryable = self.is_retryable(stage, e)
+            status = self.queue.retry(job_id, f"{stage}: {str(e)}", retryable=retryable)
+            if status == "failed":
+                if retryable:
+                    self.logger.error(f"Job #{job_id}: giving up after {self.queue.max_attempts} attempts")
+                else:
+                    self.logger.error(f"Job #{job_id}: stage '{stage}' is not retried")
+
+    def is_retryable(self, stage, e):
+        if stage in self.non_retryable_stages:
+            return False
+        ## e.g., HTTPException(404) for a file that is not in the project; a timeout (408) or rate limit (429) may pass later
+        status_code = getattr(e, "status_code", None)
+        if isinstance(status_code, int) and (400 <= status_code < 500) and (status_code not in [408, 429]):
+            return False
+        return True
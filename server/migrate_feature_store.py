@@ -0,0 +1,52 @@
+#!/usr/bin/python
+
+# Copies the integrated results (<SUBJECT_ID>_integrated_result.json) into the SQLite feature store (FEATURE_STORE_BACKEND=sqlite):
+# python migrate_feature_store.py [--integrated_results_dir <dir>] [--db_path <path>]
+# Merged as any other update (missing values never overwrite stored ones), so it can be run again safely.
+
+import os
+import json
+import argparse
+from dotenv import load_dotenv
+
+from feature_store import FeatureStore, SQLiteFeatureStore
+
+class Config:
+    def __init__(self):
+        self.source_dir = os.path.dirname(os.path.abspath(__file__))
+        self.integrated_results_dir = os.path.join(self.source_dir, "integrated_results")
+        self.db_path = os.getenv(
+            "FEATURE_STORE_DB_PATH", os.path.join(self.integrated_results_dir, "integrated_results.sqlite3")
+        )
+        self.missing_marker = -999
+
+def migrate(json_store, sqlite_store, config):
+    n_migrated, n_failed = 0, 0
+    for subject_id in json_store.list_subjects():
+        try:
+            integrated_result = json_store.read(subject_id)
+            sqlite_store.update(
+                subject_id, integrated_result, config.missing_marker, 
+                updated_at=os.path.getmtime(json_store.get_path(subject_id))
+            )
+            n_migrated += 1
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Failed to migrate {subject_id}: {e}")
+            n_failed += 1
+    return n_migrated, n_failed
+
+## ====================================================================================
+
+if __name__ == "__main__":
+    load_dotenv()
+    config = Config()
+
+    parser = argparse.ArgumentParser(description="Migrate the integrated results from JSON files to SQLite")
+    parser.add_argument("--integrated_results_dir", default=config.integrated_results_dir)
+    parser.add_argument("--db_path", default=config.db_path)
+    args = parser.parse_args()
+
+    json_store = FeatureStore(args.integrated_results_dir)
+    sqlite_store = SQLiteFeatureStore(args.db_path)
+    n_migrated, n_failed = migrate(json_store, sqlite_store, config)
+    print(f"Migrated {n_migrated} participants to {args.db_path} ({n_failed} failed)")
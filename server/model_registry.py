@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import threading
+import joblib
+
+import util
+
+AGE_GROUPS = {
+    "y": "young",
+    "o": "old"
+}
+
+def get_age_group(true_age):
+    age_abb = 'y' if true_age < 40 else 'o'
+    return age_abb, AGE_GROUPS[age_abb]
+
+class ModelBundle:
+    def __init__(self, age_abb, paths, model, scaler, percentiles, load_time):
+        self.age_abb = age_abb
+        self.age_full = AGE_GROUPS[age_abb]
+        self.paths = paths
+        self.mtimes = { k: os.path.getmtime(p) for k, p in paths.items() }
+        self.model = model
+        self.scaler = scaler
+        self.percentiles = percentiles
+        self.load_time = load_time
+
+        ## Define platform features
+        if hasattr(model, 'feature_names_in_'):
+            self.platform_features = model.feature_names_in_
+        elif hasattr(model, 'feature_name_'):
+            self.platform_features = model.feature_name_
+        else:
+            self.platform_features = util.init_platform_features()
+
+        ## Features of the cognitive domain "動作"
+        self.motor_features = tuple([ col for col in self.platform_features if col.startswith("MOTOR_GOFITTS_BEH") ])
+
+class ModelRegistry:
+    '''
+    Keeps the model, scaler and cognitive percentiles of each age group resident in memory,
+    so that /predict does not have to joblib.load() them from disk on every request.
+    Bundles are only replaced as a whole (see reload()), readers never see a half-loaded bundle.
+    '''
+    def __init__(self, config):
+        self.model_path_template = config.model_path_template
+        self.scaler_path_template = config.scaler_path_template
+        self.percentiles_path_template = config.percentiles_path_template
+        self._bundles = {}
+        self._lock = threading.Lock() # serializes reloads only; reads are lock-free
+        self._checked_at = None # time.monotonic() of the last check of the files on disk
+
+    def get_paths(self, age_abb):
+        age_full = AGE_GROUPS[age_abb]
+        return {
+            "model": self.model_path_template.replace("<age_abb>", age_abb),
+            "scaler": self.scaler_path_template.replace("<age_full>", age_full),
+            "percentiles": self.percentiles_path_template.replace("<age_full>", age_full)
+        }
+
+    def load_bundle(self, age_abb):
+        paths = self.get_paths(age_abb)
+        start = time.perf_counter()
+        model = joblib.load(paths["model"])
+        scaler = joblib.load(paths["scaler"])
+        percentiles = joblib.load(paths["percentiles"])
+        load_time = time.perf_counter() - start
+
+        return ModelBundle(age_abb, paths, model, scaler, percentiles, load_time)
+
+    def is_stale(self, age_abb):
+        bundle = self._bundles.get(age_abb)
+        if bundle is None:
+            return True
+        for key, path in bundle.paths.items():
+            if os.path.getmtime(path) != bundle.mtimes[key]:
+                return True
+        return False
+
+    def load_all(self):
+        return self.reload(force=True)
+
+    def reload(self, force=False):
+        '''
+        Reloads the bundles whose files have changed on disk (or all of them if force=True)
+        and swaps them in atomically. Returns the load time (in seconds) of each reloaded bundle.
+        '''
+        with self._lock:
+            bundles = dict(self._bundles)
+            load_times = {}
+            for age_abb in AGE_GROUPS.keys():
+                if force or self.is_stale(age_abb):
+                    bundles[age_abb] = self.load_bundle(age_abb)
+                    load_times[age_abb] = bundles[age_abb].load_time
+            self._bundles = bundles
+
+        return load_times
+
+    def refresh(self, min_interval=1.0):
+        '''
+        Reloads the bundles whose files have changed on disk, checking them at most once every min_interval seconds.
+        Called on every request, so that each worker of a multi-process server (which has its own registry)
+        picks up new model files, not only the worker that happened to serve /reload_models.
+        Keeps the current bundles if the new files cannot be loaded (e.g., while they are being copied).
+        '''
+        now = time.monotonic()
+        if (self._checked_at is not None) and (now - self._checked_at < min_interval):
+            return {}
+        self._checked_at = now
+        try:
+            if not any([ self.is_stale(age_abb) for age_abb in AGE_GROUPS.keys() ]):
+                return {}
+            return self.reload()
+        except Exception as e:
+            print(f"Failed to reload the model bundles, keeping the loaded ones: {e}")
+            return {}
+
+    def get(self, age_abb):
+        bundle = self._bundles.get(age_abb)
+        if bundle is None:
+            raise KeyError(f"No model bundle loaded for age group '{age_abb}'")
+        return bundle
+
+    def summary(self):
+        return {
+            age_abb: {
+                "age_group": bundle.age_full,
+                "load_time": round(bundle.load_time, 4),
+                "mtimes": bundle.mtimes
+            } for age_abb, bundle in self._bundles.items()
+        }
@@ -5,11 +5,17 @@ from flask import Flask, request, jsonify
 import requests
 
 import os
-import joblib
+import json
+import argparse
 import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
+from types import MappingProxyType
+import time
 import util
+from model_registry import ModelRegistry, get_age_group
+from feature_store import open_feature_store
+from http_client import get_client
 
 import logging
 logging.basicConfig(level=logging.INFO)
@@ -21,8 +27,12 @@ warnings.filterwarnings("ignore", category=InconsistentVersionWarning)
 
 class Config:
     def __init__(self):
+        self.source_dir = os.path.dirname(os.path.abspath(__file__))
+        self.integrated_results_dir = os.path.join(self.source_dir, "integrated_results")
+        self.feature_store_mode = os.getenv("FEATURE_STORE_MODE", "local") # "local": read the json files directly; "remote": via get_integrated_result.py
         self.get_integrated_result_url = os.getenv("GET_INTEGRATED_RESULT_URL")
         self.process_textreading_url = os.getenv("PROCESS_TEXTREADING_URL")
+        self.process_textreading_timeout = 1800 # seconds, transcribing the recordings takes a while
         self.local_headers = {
             "X-GitLab-Token": "tcnl-project",
             "Content-Type": "application/json"
@@ -35,32 +45,48 @@ class Config:
             "prediction", "scaler", f"cognitive_percentiles_<age_full>.pkl")
         self.correction_ref_path_template = os.path.join(
             "prediction", "model", f"<age_abb>_ref.csv")
-        self.cognitive_domains = {
-            "工作記憶": ["MEMORY_OSPAN_BEH_LETTER_ACCURACY"],
-            "情節記憶": [
+        self.cognitive_domains = MappingProxyType({
+            "工作記憶": ("MEMORY_OSPAN_BEH_LETTER_ACCURACY",),
+            "情節記憶": (
                 "MEMORY_EXCLUSION_BEH_C1_RECOLLECTION",
                 "MEMORY_EXCLUSION_BEH_C2_RECOLLECTION",
                 "MEMORY_EXCLUSION_BEH_C3_RECOLLECTION"
-            ],
-            "語言理解":  ["LANGUAGE_SPEECHCOMP_BEH_PASSIVE_ACCURACY"],
-            "語言產出": ["LANGUAGE_READING_BEH_NULL_MeanSR"], 
-            "動作": []
-        }
+            ),
+            "語言理解":  ("LANGUAGE_SPEECHCOMP_BEH_PASSIVE_ACCURACY",),
+            "語言產出": ("LANGUAGE_READING_BEH_NULL_MeanSR",), 
+            "動作": () # filled per model bundle (see ModelBundle.motor_features)
+        })
         self.using_percentile_prediction = True
         self.max_adjustment = 20 # years
-        self.brainage_prediction = True
-        self.missing_marker = -999 # marked using update_json_result() in server.py
+        self.missing_marker = -999 # marked using update_json_result() in server_common.py
         self.replace_missing_with = 0.5 # since min-max scaler is used
         self.missing_threshold = 0.2
         self.min_percentile = 10
+        self.model_check_interval = float(os.getenv("MODEL_CHECK_INTERVAL", 1)) # seconds, see ModelRegistry.refresh()
         self.metadata = 412
-        self.data = {
-            "age": -1,
-            "features": {},
-            "id_card": "",
-            "name": "", 
-            "test_date": ""
-        }        
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        ## The config is shared by all requests (threads), so it must not be changed once created
+        if getattr(self, "_frozen", False):
+            raise AttributeError(f"Config is read-only, cannot set '{name}'")
+        super().__setattr__(name, value)
+
+class PredictionContext:
+    '''
+    Per-request state of one participant's prediction (instead of storing it on the shared config), 
+    so that concurrent requests cannot corrupt each other.
+    '''
+    def __init__(self, data, features):
+        self.age = data["age"]
+        self.id_card = data["id_card"]
+        self.name = data["name"]
+        self.test_date = data["test_date"]
+        self.features = features
+        self.age_abb, self.age_full = get_age_group(self.age)
+        self.brainage_prediction = (self.age != -1) # if age is missing, do not predict brain age
+        self.domain_score_list = []
+        self.prediction = None
 
 def correct_age_with_percentile(config, true_age, prediction, domain_score_list):    
     ## Define the age group and the corresponding median age of the participant
@@ -120,170 +146,256 @@ def correct_age_with_table(config, true_age, prediction):
 
     return corrected_pad, corrected_age
 
+def is_valid_input(data):
+    return isinstance(data, dict) and all([ key in data for key in ['age', 'id_card', 'name', 'test_date'] ])
+
+def get_integrated_result(subject_id, config):
+    if config.feature_store_mode != "remote":
+        ## Read integrated_result.json from the shared feature store
+        if not feature_store.exists(subject_id):
+            print(f"Integrated result not found for subject ID: {subject_id}")
+            return None, 404
+        else:
+            return feature_store.read(subject_id), 200
+
+    ## Post request to get integrated_result.json via get_integrated_result.py   
+    feats = get_client().post(
+        url=config.get_integrated_result_url, 
+        headers=config.local_headers, 
+        json={
+            "subject_id": subject_id
+        }, 
+        retry=True # read-only
+    )
+    print(f"\nPost request to get integrated result...")
+
+    if feats.status_code != 200:
+        print(f"Failed to get integrated result for subject ID: {subject_id}")
+        return None, feats.status_code
+    else:
+        print(f"Successfully got integrated result for subject ID: {subject_id}")
+        return feats.json().get("integrated_result", {}), feats.status_code
+
+def scale_features(config, scaler, features_list):
+    ## Prepare dataframe for prediction (one row per participant)
+    DF = pd.DataFrame(index=range(len(features_list)), columns=scaler.feature_names_in_)
+    DF.update(pd.DataFrame(features_list)) 
+
+    ## Identify the positions of custom missing marker (-999; to ignore fields not listed in the json file)
+    data_is_missing = DF == config.missing_marker
+
+    ## Replace missing values with 0 before scaling
+    DF = DF.astype(float) 
+    DF = DF.replace(config.missing_marker, np.nan)
+    DF = DF.fillna(0)
+
+    ## Apply stored MinMaxScaler() to scales the dataset between 0 and 1
+    DF_scaled = pd.DataFrame(scaler.transform(DF), columns=scaler.feature_names_in_)
+
+    ## Fill missing entries with a specified value (0.5)
+    DF_scaled[data_is_missing] = config.replace_missing_with
+
+    return data_is_missing, DF_scaled
+
+def calculate_domain_scores(config, cognitive_domains, data_is_missing, DF_scaled, contexts):
+    ## Find where the features are missing, and calculate the missing ratio and the average score of each cognitive domain 
+    missing_ratios, percentiles = {}, {}
+    for cog_domain, features in cognitive_domains.items(): 
+        feature_is_missing = data_is_missing[list(features)] 
+        missing_ratios[cog_domain] = feature_is_missing.sum(axis=1) / len(features)
+        avg_score = DF_scaled[list(features)].mean(axis=1)
+
+        ## Interpolate the average score from (0, 1) to (0, 100)
+        percentile = np.interp(
+            x=avg_score, xp=[0, 1], fp=[0, 100] 
+        )
+
+        ## Reverse the percentile if the cognitive domain is "動作"
+        if cog_domain == "動作":
+            percentile = 100 - percentile
+
+        percentiles[cog_domain] = percentile
+
+    ## Collect the domain scores of each participant, and whether the brain age can be predicted
+    for i, context in enumerate(contexts):
+        for cog_domain in cognitive_domains.keys():
+            if missing_ratios[cog_domain].iloc[i] > config.missing_threshold:                             
+                context.brainage_prediction = False 
+                context.domain_score_list.append({
+                    "name": cog_domain,
+                    "score": -1
+                })
+                print(f"Missing data in cognitive domain {cog_domain}")
+                print("Prediction is not possible for this participant.")
+            else:
+                percentile = percentiles[cog_domain][i]
+
+                ## Avoid showing too low a score
+                if percentile < config.min_percentile:
+                    print(f"Too low a score in cognitive domain {cog_domain}, reset to {config.min_percentile}")
+                    percentile = config.min_percentile 
+                
+                context.domain_score_list.append({
+                    "name": cog_domain, 
+                    "score": int(round(percentile))
+                })
+                print(f"{cog_domain} percentile: {context.domain_score_list[-1]['score']}")
+
+def format_response(config, context):
+    true_age = context.age
+
+    ## Perform brain-age correction 
+    if context.prediction is not None:
+        prediction = float(context.prediction)
+        original_pad = prediction - true_age
+
+        if config.using_percentile_prediction:
+            corrected_pad, corrected_age = correct_age_with_percentile(
+                config, true_age, prediction, context.domain_score_list
+            )
+        else:
+            corrected_pad, corrected_age = correct_age_with_table(
+                config, true_age, prediction
+            )
+    else:
+        print("\nPrediction is not possible for this participant.")
+        prediction = -1
+        original_pad = -1
+        corrected_pad = -1
+        corrected_age = -1   
+
+    response = {
+        "id_card": context.id_card,
+        "name": context.name, 
+        "testDate": context.test_date, 
+        "results": {
+            "brainAge": "{:.2f}".format(corrected_age),
+            "chronologicalAge": true_age,
+            "originalPAD": "{:.2f}".format(original_pad),
+            "ageCorrectedPAD": "{:.2f}".format(corrected_pad)
+        },
+        "cognitiveFunctions": context.domain_score_list,
+        "meta": {
+            "totalParticipants": config.metadata
+        }
+    }
+    print(f"腦齡預測結果 ({context.id_card}): {response['results']['brainAge']}")
+
+    return response
+
+def predict_subjects(config, registry, contexts):
+    '''
+    Scores the participants group by group (young / old), so that each model bundle 
+    transforms and predicts a stacked matrix once instead of one row per participant.
+    Returns the responses in the same order as contexts.
+    '''
+    ## Group participants by the age group of their true age
+    groups = {}
+    for context in contexts:
+        groups.setdefault(context.age_abb, []).append(context)
+        print(f"\n受試者 {context.id_card} 真實年齡: {context.age} --> {context.age_full}")
+
+    for age_abb, group in groups.items():
+        bundle = registry.get(age_abb)
+        cognitive_domains = { **config.cognitive_domains, "動作": bundle.motor_features }
+
+        data_is_missing, DF_scaled = scale_features(
+            config, bundle.scaler, [ context.features for context in group ]
+        )
+        calculate_domain_scores(
+            config, cognitive_domains, data_is_missing, DF_scaled, group
+        )
+
+        ## Predict brain-age of those who have enough data (and a valid true age) in one call
+        rows = [ j for j, context in enumerate(group) if context.brainage_prediction ]
+        if rows:
+            print(f"\nPredicting brain age of {len(rows)} participant(s) ({bundle.age_full}) ...")
+            predictions = bundle.model.predict(DF_scaled.iloc[rows][bundle.platform_features])
+            for j, prediction in zip(rows, predictions):
+                group[j].prediction = prediction
+
+    return [ format_response(config, context) for context in contexts ]
+
+def predict_batch_records(config, registry, data_list):
+    '''
+    Validates the records and retrieves their features, then scores all valid ones with predict_subjects().
+    Returns one response (or {"id_card", "error"}) per record, in the same order.
+    '''
+    responses = [None] * len(data_list)
+    valid_indices, contexts = [], []
+
+    for i, data in enumerate(data_list):
+        if not is_valid_input(data):
+            responses[i] = { "id_card": data.get("id_card") if isinstance(data, dict) else None, "error": "Invalid input data" }
+            continue
+        try:
+            features, status_code = get_integrated_result(data['id_card'], config)
+        except requests.RequestException as e:
+            responses[i] = { "id_card": data["id_card"], "error": f"Request to get_integrated_result failed: {str(e)}" }
+            continue
+        if features is None:
+            responses[i] = { "id_card": data["id_card"], "error": f"HTTP error: {status_code}" }
+        else:
+            valid_indices.append(i)
+            contexts.append(PredictionContext(data, features))
+
+    if valid_indices:
+        scored = predict_subjects(config, registry, contexts)
+        for i, response in zip(valid_indices, scored):
+            responses[i] = response
+
+    return responses
+
+def load_batch_records(file_path):
+    ## Accepts a JSON list of {age, id_card, name, test_date} records, or a CSV file with these columns
+    if file_path.endswith(".csv"):
+        df = pd.read_csv(file_path, dtype={"id_card": str, "name": str, "test_date": str})
+        return df.to_dict(orient="records")
+    else:
+        with open(file_path, "r") as f:
+            data = json.load(f)
+        return data.get("subjects", []) if isinstance(data, dict) else data
+
 ## ====================================================================================
 
 load_dotenv()
 config = Config()
 
+feature_store = open_feature_store(config.integrated_results_dir)
+
+## Load the model bundles of both age groups once, at startup
+registry = ModelRegistry(config)
+load_times = registry.load_all()
+print("Loaded model bundles in {:.3f}s ({})".format(
+    sum(load_times.values()), ", ".join([ f"{k}: {v:.3f}s" for k, v in load_times.items() ])
+))
+
 app = Flask(__name__)
 
 @app.route('/predict', methods=['POST'])
 def predict():  
     try:
-        config.brainage_prediction = True # initialize to True
-
         ## Receive request from server.py 
         data = request.get_json(force=True)
 
-        if (not data) or ('age' not in data) or ('id_card' not in data) or ('name' not in data) or ('test_date' not in data):
+        if not is_valid_input(data):
             return jsonify({"error": "Invalid input data"}), 400
         
         else:
-            config.data.update(data)
             print("\nReceived input data at /predict:")
             print(data)
+            registry.refresh(config.model_check_interval)
                  
             try:
-                ## Post request to get integrated_result.json via get_integrated_result.py   
-                feats = requests.post(
-                    url=config.get_integrated_result_url, 
-                    headers=config.local_headers, 
-                    json={
-                        "subject_id": data['id_card']
-                    }                    
-                )
-                print(f"\nPost request to get integrated result...")
-
-                if feats.status_code != 200:
-                    print(f"Failed to get integrated result for subject ID: {data['id_card']}")
-                    return jsonify({"error": f"HTTP error: {feats.status_code}"}), feats.status_code
+                features, status_code = get_integrated_result(data['id_card'], config)
+                if features is None:
+                    return jsonify({"error": f"HTTP error: {status_code}"}), status_code
                 
                 else:
-                    print(f"Successfully got integrated result for subject ID: {data['id_card']}")
-                    result = feats.json()                
-                    config.data["features"] = result.get("integrated_result", {})
-                
-                    ## Get participant's true age
-                    true_age = config.data["age"]
-                    if true_age == -1: # if age is missing, do not predict brain age
-                        config.brainage_prediction = False                    
-
-                    ## Load stored objects according to participant's true age
-                    age_abb = 'y' if true_age < 40 else 'o'
-                    age_full = 'young' if true_age < 40 else 'old'
-                    model = joblib.load(config.model_path_template.replace("<age_abb>", age_abb))
-                    scaler = joblib.load(config.scaler_path_template.replace("<age_full>", age_full))             
-                    percentiles = joblib.load(config.percentiles_path_template.replace("<age_full>", age_full))
-
-                    print(f"\n受試者真實年齡: {true_age} --> {age_full}\n")
-
-                    ## Define platform features 
-                    if hasattr(model, 'feature_names_in_'):
-                        platform_features = model.feature_names_in_
-                    elif hasattr(model, 'feature_name_'):
-                        platform_features = model.feature_name_
-                    else:
-                        platform_features = util.init_platform_featuress
-
-                    ## Update cognitive domain "動作"
-                    config.cognitive_domains["動作"] = [ col for col in platform_features if col.startswith("MOTOR_GOFITTS_BEH") ]
-
-                    ## Prepare dataframe for prediction
-                    DF = pd.DataFrame(index=range(1), columns=scaler.feature_names_in_)
-                    DF.update(pd.DataFrame([config.data["features"]])) 
-
-                    ## Identify the positions of custom missing marker (-999; to ignore fields not listed in the json file)
-                    data_is_missing = DF == config.missing_marker
-
-                    ## Replace missing values with 0 before scaling
-                    DF = DF.astype(float) 
-                    DF = DF.replace(config.missing_marker, np.nan)
-                    DF = DF.fillna(0)
-
-                    ## Apply stored MinMaxScaler() to scales the dataset between 0 and 1
-                    DF_scaled = pd.DataFrame(scaler.transform(DF), columns=scaler.feature_names_in_)
-
-                    ## Fill missing entries with a specified value (0.5)
-                    DF_scaled[data_is_missing] = config.replace_missing_with
-
-                    ## Calculate the average scores for each cognitive domain
-                    domain_score_list = []
-                    for cog_domain, features in config.cognitive_domains.items(): 
-
-                        ## Find where the features are missing and calculate the missing ratio 
-                        feature_is_missing = data_is_missing[features] 
-                        missing_ratio = feature_is_missing.sum(axis=1) / len(features)
-
-                        ## Calculate the average score of the features
-                        if missing_ratio.iloc[0] > config.missing_threshold:                             
-                            config.brainage_prediction = False 
-                            domain_score_list.append({
-                                "name": cog_domain,
-                                "score": -1
-                            })
-                            print(f"Missing data in cognitive domain {cog_domain}")
-                            print("Prediction is not possible for this participant.")
-                        else:
-                            avg_score = DF_scaled[features].mean(axis=1).iloc[0]                            
-
-                            ## Interpolate the average score from (0, 1) to (0, 100)
-                            percentile = np.interp(
-                                x=avg_score, xp=[0, 1], fp=[0, 100] 
-                            )
-
-                            ## Reverse the percentile if the cognitive domain is "動作"
-                            if cog_domain == "動作":
-                                percentile = 100 - percentile
-                                
-                            ## Avoid showing too low a score
-                            if percentile < config.min_percentile:
-                                print(f"Too low a score in cognitive domain {cog_domain}, reset to {config.min_percentile}")
-                                percentile = config.min_percentile 
-                            
-                            domain_score_list.append({
-                                "name": cog_domain, 
-                                "score": int(round(percentile))
-                            })
-                            print(f"{cog_domain} percentile: {domain_score_list[-1]['score']}")
-
-                    ## Predict brain-age
-                    if config.brainage_prediction:
-                        print("\nPredicting brain age ...")
-                        prediction = float(model.predict(DF_scaled[platform_features])[0])
-                        original_pad = prediction - true_age
-
-                        ## Perform brain-age correction 
-                        if config.using_percentile_prediction:
-                            corrected_pad, corrected_age = correct_age_with_percentile(
-                                config, true_age, prediction, domain_score_list
-                            )
-                        else:
-                            corrected_pad, corrected_age = correct_age_with_table(
-                                config, true_age, prediction
-                            )
-                    else:
-                        print("\nPrediction is not possible for this participant.")
-                        prediction = -1
-                        original_pad = -1
-                        corrected_pad = -1
-                        corrected_age = -1   
-
-                    response = {
-                        "id_card": config.data["id_card"],
-                        "name": config.data["name"], 
-                        "testDate": config.data["test_date"], 
-                        "results": {
-                            "brainAge": "{:.2f}".format(corrected_age),
-                            "chronologicalAge": true_age,
-                            "originalPAD": "{:.2f}".format(original_pad),
-                            "ageCorrectedPAD": "{:.2f}".format(corrected_pad)
-                        },
-                        "cognitiveFunctions": domain_score_list,
-                        "meta": {
-                            "totalParticipants": config.metadata
-                        }
-                    }
-                    print(f"腦齡預測結果: {response['results']['brainAge']}")
+                    inference_start = time.perf_counter()
+                    context = PredictionContext(data, features)
+                    response = predict_subjects(config, registry, [context])[0]
+                    print(f"Inference time: {time.perf_counter() - inference_start:.4f}s")
                     print("‧★,:*:‧\(^o^)/‧:*‧°★*\n")
 
                     return jsonify(response), 200
@@ -297,7 +409,54 @@ def predict():
         print("\nUnexpected error during prediction:", str(e))        
         print("Traceback:", traceback.format_exc())
         return jsonify({"error": str(e)}), 500
+
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():  
+    try:
+        ## Receive a list of {age, id_card, name, test_date} records (or {"subjects": [...]})
+        data = request.get_json(force=True)
+        data_list = data.get("subjects") if isinstance(data, dict) else data
+
+        if (not isinstance(data_list, list)) or (len(data_list) == 0):
+            return jsonify({"error": "Invalid input data"}), 400
+        
+        else:
+            print(f"\nReceived {len(data_list)} records at /predict_batch")
+            registry.refresh(config.model_check_interval)
+            batch_start = time.perf_counter()
+            responses = predict_batch_records(config, registry, data_list)
+            print(f"Scored {len(data_list)} records in {time.perf_counter() - batch_start:.4f}s")
+
+            return jsonify({"results": responses}), 200
+
+    except Exception as e:
+        import traceback
+        print("\nUnexpected error during batch prediction:", str(e))        
+        print("Traceback:", traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
     
+@app.route('/reload_models', methods=['POST'])
+def reload_models():
+    try:
+        ## Reload the bundles whose files have changed on disk (all of them if "force" is set)
+        ## Only in the worker serving this request; the other workers reload the changed files on their next request (see ModelRegistry.refresh())
+        data = request.get_json(silent=True) or {}
+        load_times = registry.reload(force=bool(data.get("force", False)))
+        if load_times:
+            print(f"\nReloaded model bundles: {load_times}")
+        else:
+            print("\nModel bundles are up to date, nothing to reload")
+
+        return jsonify({
+            "reloaded": list(load_times.keys()), 
+            "load_time": load_times, 
+            "bundles": registry.summary()
+        }), 200
+
+    except Exception as e:
+        print("\nUnexpected error while reloading models: ", str(e))
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/process_textreading', methods=['POST'])
 def process_textreading_proxy(): 
     config = Config()
@@ -309,10 +468,11 @@ def process_textreading_proxy():
         
         else:
             print(f"\nReceived input data at /process_textreading: {data}")
-            resp = requests.post(
+            resp = get_client().post(
                 url=config.process_textreading_url, 
                 headers=config.local_headers, 
-                json=data
+                json=data, 
+                timeout=config.process_textreading_timeout
             )      
             if resp.status_code == 200:
                 return jsonify({
@@ -356,5 +516,25 @@ def not_found(e):
     return jsonify({"error": f"Path {request.path} not found."}), 404
 
 if __name__ == "__main__":
-    print("Starting Flask server...")
-    app.run(host='0.0.0.0', port=8888)
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", type=str, default=None, 
+                        help="Score the records in a JSON (list of {age, id_card, name, test_date}) or CSV file instead of starting the server.")
+    parser.add_argument("--output", type=str, default=None, 
+                        help="Where to save the batch results (JSON). Printed to stdout if not given.")
+    args = parser.parse_args()
+
+    if args.batch is not None:
+        data_list = load_batch_records(args.batch)
+        batch_start = time.perf_counter()
+        responses = predict_batch_records(config, registry, data_list)
+        print(f"\nScored {len(data_list)} records in {time.perf_counter() - batch_start:.4f}s")
+
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump(responses, f, indent=2, ensure_ascii=False)
+            print(f"Saved batch results to {args.output}")
+        else:
+            print(json.dumps(responses, indent=2, ensure_ascii=False))
+    else:
+        print("Starting Flask server...")
+        app.run(host='0.0.0.0', port=8888, threaded=True)
\ No newline at end of file
@@ -1,9 +1,12 @@
 #!/usr/bin/python
 
 import os
+import fcntl
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import logging
-import requests
+from http_client import get_client
 from dotenv import load_dotenv
 
 class Config:
@@ -13,19 +16,24 @@ class Config:
         self.log_fn_format = "processTasks_%Y-%m-%d.log"
         self.process_textreading_url = os.getenv("PROCESS_TEXTREADING_URL")
         self.predict_url = os.getenv("PREDICT_URL")
+        self.process_textreading_timeout = 1800 # seconds, transcribing the recordings takes a while
+        self.lock_path = os.path.join(self.log_dir, "process_tasks.lock")
+        self.n_transcribe_workers = int(os.getenv("PROCESS_TASKS_TRANSCRIBE_WORKERS", 1)) # CPU-heavy (Whisper)
+        self.n_api_workers = int(os.getenv("PROCESS_TASKS_API_WORKERS", 4)) # I/O-bound
         self.local_headers = {
             "X-GitLab-Token": "tcnl-project",
             "Content-Type": "application/json"
         }
 
 def execute_process_textreading(subject_id, csv_filename, config, logger): 
-    res = requests.post(
+    res = get_client().post(
         url=config.process_textreading_url, 
         headers=config.local_headers, 
         json={
             "subject_id": subject_id,
             "csv_filename": csv_filename
-        }
+        }, 
+        timeout=config.process_textreading_timeout
     )
     if res.status_code == 200:
         logger.info(f"Successfully sent process_textreading request for {subject_id}")
@@ -33,7 +41,7 @@ def execute_process_textreading(subject_id, csv_filename, config, logger):
         raise Exception(f"Failed to send process_textreading request for {subject_id}: {res.status_code}")
 
 def get_user_info(subject_id, logger):
-    res = requests.get(
+    res = get_client().get(
         url=f'https://qoca-api.chih-he.dev/user/{subject_id}'
     )
     if res.status_code == 200:
@@ -43,7 +51,7 @@ def get_user_info(subject_id, logger):
         raise Exception(f"Failed to retrieve user info for {subject_id}: {res.status_code}")
 
 def get_predict_result(age, subject_id, name, test_date, config, logger):
-    res = requests.post(
+    res = get_client().post(
         url=config.predict_url, 
         headers=config.local_headers, 
         json={
@@ -51,7 +59,8 @@ def get_predict_result(age, subject_id, name, test_date, config, logger):
             "id_card": subject_id, 
             "name": name, 
             "test_date": test_date
-        }
+        }, 
+        retry=True # /predict has no side effects
     )
     if res.status_code == 200:
         logger.info(f"Successfully retrieved predict_result for {subject_id}")
@@ -60,7 +69,7 @@ def get_predict_result(age, subject_id, name, test_date, config, logger):
         raise Exception(f"Failed to retrieve predict_result for {subject_id}: {res.status_code}")
 
 def update_report_status(task_id, status, logger):
-    res = requests.put(
+    res = get_client().put(
         url=f"https://qoca-api.chih-he.dev/tasks/{task_id}", 
         json={
             "status": status
@@ -72,7 +81,7 @@ def update_report_status(task_id, status, logger):
         raise Exception(f"Failed to update report status for task #{task_id}: {res.status_code}")
 
 def update_predict_result(exam_id, predict_result, logger):
-    res = requests.put(
+    res = get_client().put(
         url=f"https://qoca-api.chih-he.dev/exams/{exam_id}", 
         json=predict_result
     )
@@ -81,6 +90,57 @@ def update_predict_result(exam_id, predict_result, logger):
     else:
         raise Exception(f"Failed to update predict_result for exam #{exam_id}: {res.status_code}")
 
+def process_task(task, slots, config, logger):
+    task_id = task['id']
+    exam_id = task['exam_id']
+    csv_filename = task['csv_filename']
+    subject_id = csv_filename.split('_')[0]
+    test_date = os.path.splitext(csv_filename)[0].split('_')[-1]
+
+    with slots["transcribe"]:
+        execute_process_textreading(
+            subject_id, csv_filename, config, logger
+        )
+    with slots["api"]:
+        user_info = get_user_info(
+            subject_id, logger
+        )
+        predict_result = get_predict_result(
+            user_info['age'], subject_id, user_info['name'], test_date, config, logger
+        )
+        if predict_result is not None:
+            update_report_status(task_id, 1, logger) # for the first report
+
+            predict_result['report_status'] = 0 # for the second report
+            predict_result['testDate'] = datetime.strptime(
+                predict_result['testDate'], "%Y-%m-%dT%H%M%S.%fZ"
+            ).isoformat()
+            update_predict_result(exam_id, predict_result, logger)
+
+def run_task(task, slots, config, logger):
+    ## A failed task is logged and left for the next run, without aborting the others
+    try:
+        process_task(task, slots, config, logger)
+        return True
+    except Exception as e:
+        logger.error(f"Failed to process task #{task['id']} ({task['csv_filename']}): {str(e)}")
+        return False
+
+def acquire_lock(config):
+    ## Returns the opened lock file, or None if another process_tasks.py is still running
+    ## Opened without truncating it, so that the PID of the running process is kept if the lock is taken
+    lock_file = open(config.lock_path, "a+")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    return lock_file
+
 ## ====================================================================================
 
 if __name__ == "__main__":
@@ -94,9 +154,14 @@ if __name__ == "__main__":
         format="%(asctime)s [%(levelname)s] %(filename)s:%(lineno)4d: %(message)s"
     )
     logger = logging.getLogger(__name__)    
+
+    lock_file = acquire_lock(config)
+    if lock_file is None:
+        logger.info("Previous run is still processing tasks, skipping this run")
+        raise SystemExit(0)
     
     ## Search for tasks that need to be processed (is_file_ready=1 & status=0)
-    res = requests.get(
+    res = get_client().get(
         url="https://qoca-api.chih-he.dev/tasks?is_file_ready=1&status=0"
     )
     if res.status_code == 200:
@@ -108,27 +173,17 @@ if __name__ == "__main__":
         else:
             logger.info(f"Retrieved {len(tasks)} tasks to process")
 
-            for task in tasks:
-                task_id = task['id']
-                exam_id = task['exam_id']
-                csv_filename = task['csv_filename']
-                subject_id = csv_filename.split('_')[0]
-                test_date = os.path.splitext(csv_filename)[0].split('_')[-1]
-
-                execute_process_textreading(
-                    subject_id, csv_filename, config, logger
-                )
-                user_info = get_user_info(
-                    subject_id, logger
-                )
-                predict_result = get_predict_result(
-                    user_info['age'], subject_id, user_info['name'], test_date, config, logger
-                )
-                if predict_result is not None:
-                    update_report_status(task_id, 1, logger) # for the first report
-
-                    predict_result['report_status'] = 0 # for the second report
-                    predict_result['testDate'] = datetime.strptime(
-                        predict_result['testDate'], "%Y-%m-%dT%H%M%S.%fZ"
-                    ).isoformat()
-                    update_predict_result(exam_id, predict_result, logger)
\ No newline at end of file
+            ## The transcription and the API calls of different tasks overlap, each with its own limit
+            slots = {
+                "transcribe": threading.BoundedSemaphore(config.n_transcribe_workers), 
+                "api": threading.BoundedSemaphore(config.n_api_workers)
+            }
+            n_workers = config.n_transcribe_workers + config.n_api_workers
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                succeeded = list(executor.map(
+                    lambda task: run_task(task, slots, config, logger), tasks
+                ))
+            logger.info(f"Processed {sum(succeeded)} of {len(tasks)} tasks")
+
+    get_client().log_metrics()
+    lock_file.close()
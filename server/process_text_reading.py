@@ -14,17 +14,15 @@ import pandas as pd
 from dotenv import load_dotenv
 
 import util
-from server import Config, authenticate_gitlab, convert_np_types, update_json_result
-from data_processors.textreading_processor import TextReadingProcessor
+from server_common import Config, authenticate_gitlab, convert_np_types, update_json_result
+from task_integrator import get_processors
 
 class SubjectReprocessRequest(BaseModel):
     subject_id: str
     csv_filename: str 
 
 def process_text_reading(subject_id: str, csv_filename: str, config, logger) -> dict:
-    text_reading_processor = TextReadingProcessor(
-        data_dir=os.path.join(config.data_dir, config.exp_textreading_name)
-    )
+    text_reading_processor = get_processors()[config.exp_textreading_name]
     result = {
         "status": "error",
         "message": "",
@@ -54,19 +52,14 @@ def process_text_reading(subject_id: str, csv_filename: str, config, logger) ->
                 logger.info(f"Found {len(audio_files)} audio files for subject {subject_id} on date {test_date}")
                 result["files_processed"] = [ os.path.basename(f) for f in audio_files ]
 
-                csv_files = []
-                for audio_file in audio_files:
-                    logger.info(f"\nProcessing audio file: {audio_file}")
-                    try:
-                        csv_file = text_reading_processor.generate_csv(audio_file)
-                        if csv_file:
-                            csv_files.append(csv_file)
-                    except Exception as e:
-                        logger.error(f"\nError processing audio file {audio_file}: {str(e)}")
+                logger.info(f"\nProcessing audio files with {text_reading_processor.n_workers} workers")
+                word_timings_list = [ 
+                    t for t in text_reading_processor.get_all_word_timings(audio_files) if t is not None 
+                ]
 
-                if csv_files:
+                if word_timings_list:
                     try:
-                        mean_speech_rate = text_reading_processor.calculate_mean_syllable_speech_rate(csv_files)
+                        mean_speech_rate = text_reading_processor.calculate_mean_syllable_speech_rate(word_timings_list)
 
                         if mean_speech_rate is None:
                             result["message"] = "Failed to calculate mean speech rate. "
@@ -92,7 +85,7 @@ def process_text_reading(subject_id: str, csv_filename: str, config, logger) ->
                         result["message"] = f"Error in calculating mean speech rate: {str(e)}"
                 
                 else:
-                    result["message"] = f"No CSV files generated for subject {subject_id}"
+                    result["message"] = f"No word timings generated for subject {subject_id}"
                     return result
                 
         except Exception as e:
@@ -6,7 +6,7 @@
 import os
 import sys
 import glob
-import requests
+from http_client import get_client
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -70,7 +70,7 @@ if __name__ == "__main__":
         # print(f"csv_filename: {csv_filename}")
         csv_filename = sys.argv[2]
 
-        res = requests.post(
+        res = get_client().post(
             url=config.webhook_url, 
             headers=config.local_headers, 
             json={
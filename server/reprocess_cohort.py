@@ -0,0 +1,139 @@
+#!/usr/bin/python
+
+# Reprocesses the raw CSV files of all participants (e.g., after a change in a processor) and merges the results into the feature store:
+# python reprocess_cohort.py [--tasks <EXPERIMENT_NAME> ...] [--workers <n>] [--full] [--dry_run]
+#
+# A participant's task is skipped if its raw file and the version of its processor are the same as in the last run
+# (recorded in data/.reprocess_manifest.json) and it gave a result, unless --full is given,
+# in which case the results cached by TaskIntegrator (see result_cache.py) are not used either.
+# TextReading is not included: its recordings are transcribed by process_tasks.py.
+
+import os
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+import util
+from feature_store import open_feature_store
+from task_integrator import TaskIntegrator, get_processors, get_processor_version, store_result
+
+class Config:
+    def __init__(self):
+        self.source_dir = os.path.dirname(os.path.abspath(__file__))
+        self.data_dir = os.path.join(self.source_dir, "..", "data")
+        self.integrated_results_dir = os.path.join(self.source_dir, "integrated_results")
+        self.manifest_path = os.path.join(self.data_dir, ".reprocess_manifest.json")
+        self.exp_textreading_name = os.getenv("EXPERIMENT_TEXTREADING_NAME")
+        self.platform_features = util.init_platform_features()
+        self.missing_marker = -999
+        self.n_workers = int(os.getenv("REPROCESS_WORKERS", os.cpu_count() or 1))
+        self.manifest_save_every = 50 # runs
+
+def load_manifest(config):
+    if not os.path.exists(config.manifest_path):
+        return {}
+    with open(config.manifest_path, "r") as f:
+        return json.load(f)
+
+def save_manifest(manifest, config):
+    tmp_path = f"{config.manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, config.manifest_path)
+
+def get_sha256(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def find_runs(tasks, manifest, config, full=False):
+    '''
+    Lists the (task, subject ID) pairs found under data/<EXPERIMENT_NAME>, with the raw file that TaskIntegrator would use,
+    and returns those whose file or processor version has changed since the last run or that gave no result (all of them if full).
+    '''
+    integrator = TaskIntegrator()
+    runs = []
+    for task in tasks:
+        processor = integrator.processors[task]
+        version = get_processor_version(type(processor))
+        subject_ids = sorted(set([
+            file_name.split('_')[0] for file_name in os.listdir(processor.data_dir) if file_name.endswith(".csv")
+        ])) if os.path.isdir(processor.data_dir) else []
+
+        for subject_id in subject_ids:
+            file_path = integrator.find_file(processor.data_dir, subject_id, task)
+            if file_path is None:
+                continue
+            entry = {
+                "file": os.path.basename(file_path),
+                "sha256": get_sha256(file_path),
+                "processor_version": version
+            }
+            previous = manifest.get(f"{task}/{subject_id}", {})
+            changed = any([ previous.get(key) != value for key, value in entry.items() ])
+            if full or changed or not previous.get("has_result", False):
+                runs.append((task, subject_id, entry))
+    return runs
+
+def process_task_subject(task, subject_id, use_result_cache=True):
+    ## Runs in a worker process, with its own processors
+    return TaskIntegrator(use_result_cache=use_result_cache).process_subject(subject_id, tasks_to_process=[task])
+
+def reprocess(runs, feature_store, manifest, config, use_result_cache=True):
+    n_done, n_failed = 0, 0
+    with ProcessPoolExecutor(max_workers=config.n_workers) as executor:
+        futures = {
+            executor.submit(process_task_subject, task, subject_id, use_result_cache): (task, subject_id, entry)
+            for task, subject_id, entry in runs
+        }
+        for future in as_completed(futures):
+            task, subject_id, entry = futures[future]
+            try:
+                result_df = future.result()
+            except Exception as e:
+                print(f"Failed to process {task} for subject {subject_id}: {e}")
+                n_failed += 1
+                continue # not recorded, so it is retried next time
+
+            if result_df is not None:
+                store_result(feature_store, subject_id, result_df, config.platform_features, config.missing_marker)
+            manifest[f"{task}/{subject_id}"] = { **entry, "has_result": result_df is not None, "processed_at": time.time() }
+
+            n_done += 1
+            if n_done % config.manifest_save_every == 0:
+                save_manifest(manifest, config)
+                print(f"Processed {n_done}/{len(runs)}")
+
+    save_manifest(manifest, config)
+    return n_done, n_failed
+
+## ====================================================================================
+
+if __name__ == "__main__":
+    load_dotenv()
+    config = Config()
+    csv_tasks = [ task for task in get_processors() if task != config.exp_textreading_name ]
+
+    parser = argparse.ArgumentParser(description="Reprocess the raw data of all participants")
+    parser.add_argument("--tasks", nargs="+", choices=csv_tasks, default=csv_tasks)
+    parser.add_argument("--workers", type=int, default=config.n_workers)
+    parser.add_argument("--full", action="store_true", help="ignore the manifest and reprocess everything")
+    parser.add_argument("--dry_run", action="store_true", help="only list what would be reprocessed")
+    args = parser.parse_args()
+    config.n_workers = args.workers
+
+    manifest = load_manifest(config)
+    runs = find_runs(args.tasks, manifest, config, full=args.full)
+    print(f"{len(runs)} task results to reprocess")
+    if args.dry_run:
+        for task, subject_id, entry in runs:
+            print(f"{task}: {subject_id} ({entry['file']})")
+    elif runs:
+        feature_store = open_feature_store(config.integrated_results_dir)
+        n_done, n_failed = reprocess(runs, feature_store, manifest, config, use_result_cache=not args.full)
+        print(f"Reprocessed {n_done} task results ({n_failed} failed)")
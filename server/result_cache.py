@@ -0,0 +1,115 @@
+#!/usr/bin/python
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+
+class ResultCache:
+    '''
+    Keeps the feature row computed by a processor for a raw file, under <cache_dir>/<key>.json,
+    where the key is derived from the SHA-256 of the file, the processor and its version (see get_processor_version() in task_integrator.py),
+    so that a file that has already been processed (webhook redeliveries, pseudo commits, reports) is not parsed again.
+    The least recently used entries are evicted when the cache is larger than max_size_mb.
+    '''
+    def __init__(self, cache_dir, max_size_mb=64):
+        self.cache_dir = cache_dir
+        self.max_size_mb = max_size_mb
+        self._counts = { "hits": 0, "misses": 0, "evictions": 0 }
+        self._lock = threading.Lock()
+
+    def get_key(self, file_path, processor_name, processor_version):
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        return hashlib.sha256(
+            f"{sha256.hexdigest()}:{processor_name}:{processor_version}".encode()
+        ).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def get(self, key):
+        '''
+        Returns the cached result (a one-row DataFrame), or None on a miss.
+        '''
+        entry_path = self.get_path(key)
+        try:
+            with open(entry_path, "r") as f:
+                entry = json.load(f)
+            os.utime(entry_path) # marks the entry as recently used
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.count("misses")
+            return None
+        self.count("hits")
+        return pd.DataFrame([entry["values"]], columns=entry["columns"])
+
+    def put(self, key, result_df):
+        ## One row, as compact JSON (NumPy values as plain ones), written to a temporary file and renamed
+        os.makedirs(self.cache_dir, exist_ok=True)
+        values = [ value.item() if isinstance(value, np.generic) else value for value in result_df.iloc[0].tolist() ]
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({ "columns": list(result_df.columns), "values": values }, f, separators=(",", ":"))
+        os.replace(tmp_path, self.get_path(key))
+        self.evict()
+
+    def evict(self):
+        entries = [] # (last used, size, path)
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue # evicted by another process in the meantime
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        total_size = sum([ size for _, size, _ in entries ])
+        for _, size, entry_path in entries:
+            if total_size <= self.max_size_mb * 1024 * 1024:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass # already evicted by another process
+            total_size -= size
+            self.count("evictions")
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        n_lookups = counts["hits"] + counts["misses"]
+        return { **counts, "hit_rate": round(counts["hits"] / n_lookups, 4) if n_lookups else None }
+
+## ====================================================================================
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_result_cache():
+    '''
+    Returns the process-wide ResultCache (None if RESULT_CACHE_ENABLED=false), created on first use so that the settings in .env are already loaded.
+    '''
+    global _cache
+    if os.getenv("RESULT_CACHE_ENABLED", "true").lower() != "true":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache(
+                    cache_dir=os.getenv(
+                        "RESULT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", ".result_cache")
+                    ),
+                    max_size_mb=float(os.getenv("RESULT_CACHE_MAX_SIZE_MB", 64))
+                )
+    return _cache
@@ -2,128 +2,143 @@
 
 import os
 import logging
-import numpy as np
 import pandas as pd
 from datetime import datetime, timezone
 import json
+import hashlib
+import tempfile
+import threading
 
-from fastapi import BackgroundTasks, Depends, FastAPI, Header, HTTPException, Request
+from fastapi import Body, Depends, FastAPI, HTTPException, Request
 from pydantic import BaseModel
 import uvicorn
-import requests
 from dotenv import load_dotenv
 
-import util
-from task_integrator import TaskIntegrator, process_and_format_result
-
-class Config:
-    def __init__(self):
-        self.source_dir = os.path.dirname(os.path.abspath(__file__))
-        self.data_dir = os.path.join(self.source_dir, "..", "data")
-        self.integrated_results_dir = os.path.join(self.source_dir, "integrated_results")
-        self.predict_url = os.getenv("PREDICT_URL")  
-        self.fetch_file_url = "https://gitlab.pavlovia.org/api/v4/projects/{}/repository/files/data%2F{}/raw?ref=master"
-        self.gitlab_token = os.getenv("GITLAB_TOKEN")
-        self.gitlab_headers = {
-            "Authorization": f"Bearer {self.gitlab_token}"
-        }
-        self.local_headers = {
-            "X-GitLab-Token": "tcnl-project",
-            "Content-Type": "application/json"
-        }
-        self.qoca_headers = {
-            "Content-Type": "application/json"
-        }
-        self.exp_gofitt_name = os.getenv("EXPERIMENT_GOFITT_NAME")
-        self.exp_ospan_name = os.getenv("EXPERIMENT_OSPAN_NAME")
-        self.exp_speechcomp_name = os.getenv("EXPERIMENT_SPEECHCOMP_NAME")
-        self.exp_exclusion_name = os.getenv("EXPERIMENT_EXCLUSION_NAME")
-        self.exp_textreading_name = os.getenv("EXPERIMENT_TEXTREADING_NAME")
-        self.exp_name_list = [self.exp_gofitt_name, self.exp_ospan_name, self.exp_speechcomp_name, self.exp_exclusion_name, self.exp_textreading_name]
-        self.platform_features = util.init_platform_features()
-        self.missing_marker = -999
-
-def authenticate_gitlab(x_gitlab_token: str = Header(...)):
-    if x_gitlab_token != 'tcnl-project':
-        raise HTTPException(status_code=403)
-    return x_gitlab_token
+from task_integrator import TaskIntegrator, get_processors
+from job_queue import JobQueue, JobWorkerPool
+from http_client import get_client
+from server_common import Config, authenticate_gitlab, update_json_result, get_feature_store
+
+class FetchIndex:
+    '''
+    Remembers the ETag and SHA-256 of the files fetched from GitLab (<data_dir>/.fetch_index.json), 
+    so that a file already on disk can be trusted without downloading it again, or revalidated with a conditional request.
+    The index is kept in memory and re-read only when the file's modification time or size changes (as in FeatureStore.read).
+    '''
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._index = {}
+        self._stamp = None # (mtime, size) of the file that self._index was read from
+        self._lock = threading.Lock()
+
+    def load(self):
+        ## Called with self._lock held
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            self._index, self._stamp = {}, None
+            return self._index
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp != self._stamp:
+            with open(self.index_path, "r") as f:
+                self._index = json.load(f)
+            self._stamp = stamp
+        return self._index
+
+    def get(self, key):
+        with self._lock:
+            entry = self.load().get(key)
+        return None if entry is None else dict(entry)
+
+    def set(self, key, entry):
+        with self._lock:
+            index = dict(self.load())
+            index[key] = entry
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(index, f, indent=2)
+            os.replace(tmp_path, self.index_path)
+            stat = os.stat(self.index_path)
+            self._index, self._stamp = index, (stat.st_mtime_ns, stat.st_size)
+
+def is_local_file_valid(file_path, entry):
+    if not os.path.exists(file_path):
+        return False
+    elif entry is None: # fetched before the index existed
+        return True
+    else:
+        return os.path.getsize(file_path) == entry["size"]
 
 def fetch_file(project_name, project_id, filename, config, logger):
-    resp = requests.get(
-        url=config.fetch_file_url.format(project_id, filename), 
-        headers=config.gitlab_headers
-    )
-    if resp.status_code == 200:
-        project_dir = os.path.join(config.data_dir, project_name)
-        if not os.path.exists(project_dir):
-            os.makedirs(project_dir)
-        file_path = os.path.join(project_dir, filename)
-        if os.path.exists(file_path):
+    project_dir = os.path.join(config.data_dir, project_name)
+    if not os.path.exists(project_dir):
+        os.makedirs(project_dir)
+    file_path = os.path.join(project_dir, filename)
+    index_key = f"{project_name}/{filename}"
+    entry = fetch_index.get(index_key)
+
+    ## Local-first: no network call when the file is already on disk (e.g., redeliveries and pseudo commits)
+    headers = dict(config.gitlab_headers)
+    if is_local_file_valid(file_path, entry):
+        if not config.revalidate_fetched_files:
             logger.info(f"File {file_path} already exists, skipping download.")
             return file_path
-        else:
-            with open(file_path, "wb") as f:
-                f.write(resp.content)
+        elif (entry is not None) and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+
+    with get_client().get(
+        url=config.fetch_file_url.format(project_id, filename), 
+        headers=headers, 
+        stream=True, 
+        timeout=config.fetch_timeout
+    ) as resp:
+        if resp.status_code == 304:
+            logger.info(f"File {file_path} is up to date, skipping download.")
+            return file_path
+        elif resp.status_code == 200:
+            ## Stream the body to a temporary file, which replaces the data file only once complete
+            sha256 = hashlib.sha256()
+            size = 0
+            ## (unique name, so that concurrent fetches of the same file never write to the same temporary file)
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(file_path), prefix=f".{os.path.basename(file_path)}.", suffix=".part"
+            )
+            try:
+                os.chmod(tmp_path, 0o644) # as the files written with open()
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in resp.iter_content(chunk_size=config.fetch_chunk_size):
+                        f.write(chunk)
+                        sha256.update(chunk)
+                        size += len(chunk)
+                os.replace(tmp_path, file_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            fetch_index.set(index_key, {
+                "etag": resp.headers.get("ETag"), 
+                "sha256": sha256.hexdigest(), 
+                "size": size, 
+                "fetched_at": datetime.now(timezone.utc).isoformat()
+            })
             logger.info(f"Successfully fetched file from project {project_name}.")
             return file_path
-    else:
-        print(f"{resp.text}")
-        logger.error(f"Failed to fetch file {filename} from project {project_name}.")
-        raise HTTPException(status_code=404, detail=f"File {filename} not found in project {project_name}.")
-
-def convert_np_types(obj):
-    if isinstance(obj, (np.integer, np.int64)):
-        return int(obj)
-    elif isinstance(obj, (np.floating, np.float64)):
-        return float(obj)
-    if isinstance(obj, np.ndarray):
-        return obj.tolist() # Convert np.ndarray to list
-    elif isinstance(obj, np.generic): 
-        return obj.item() # Convert np.generic to scalar
-    elif isinstance(obj, list):
-        return [ convert_np_types(i) for i in obj ] 
-    elif isinstance(obj, dict):
-        return { k: convert_np_types(v) for k, v in obj.items() } 
-    else:
-        return obj
-
-def update_json_result(subject_id, result_df, config, logger):
-    json_file_path = os.path.join(
-        config.integrated_results_dir, f"{subject_id}_integrated_result.json"
-    )
-    if os.path.exists(json_file_path):
-        with open(json_file_path, 'r') as json_file:
-            existing_data = json.load(json_file)
-    else:
-        existing_data = { 
-            feature: config.missing_marker for feature in config.platform_features 
-        }
-    result_df = result_df.replace([pd.NA, pd.NaT, float('inf'), float('-inf')], config.missing_marker)
-    result_df = result_df.fillna(config.missing_marker)
-    formatted_result = process_and_format_result(
-        result_df, config.platform_features
-    )
-    for key, value in formatted_result.items():
-        if value != config.missing_marker:
-            existing_data[key] = value
-        elif key not in existing_data:
-            existing_data[key] = config.missing_marker
-
-    with open(json_file_path, 'w') as f:
-        json.dump(existing_data, f, indent=2, default=convert_np_types)
-    logger.info(f"Successfully updated {json_file_path}")
+        else:
+            print(f"{resp.text}")
+            logger.error(f"Failed to fetch file {filename} from project {project_name}.")
+            raise HTTPException(status_code=404, detail=f"File {filename} not found in project {project_name}.")
 
 def process_file(project_name, filepath, config, logger): 
     subject_id = os.path.basename(filepath).split('_')[0]
     
     if project_name == config.exp_gofitt_name:
-        result_df = TaskIntegrator().process_subject(subject_id, tasks_to_process=[config.exp_gofitt_name])
+        result_df = task_integrator.process_subject(subject_id, tasks_to_process=[config.exp_gofitt_name])
     elif project_name == config.exp_ospan_name:
-        result_df = TaskIntegrator().process_subject(subject_id, tasks_to_process=[config.exp_ospan_name])
+        result_df = task_integrator.process_subject(subject_id, tasks_to_process=[config.exp_ospan_name])
     elif project_name == config.exp_speechcomp_name:
-        result_df = TaskIntegrator().process_subject(subject_id, tasks_to_process=[config.exp_speechcomp_name])
+        result_df = task_integrator.process_subject(subject_id, tasks_to_process=[config.exp_speechcomp_name])
     elif project_name == config.exp_exclusion_name:
-        result_df = TaskIntegrator().process_subject(subject_id, tasks_to_process=[config.exp_exclusion_name])
+        result_df = task_integrator.process_subject(subject_id, tasks_to_process=[config.exp_exclusion_name])
     elif project_name == config.exp_textreading_name:
         logger.info(f"Skipping data processing for TextReading")
         result_df = None
@@ -137,7 +152,7 @@ def process_file(project_name, filepath, config, logger):
         logger.warning(f"No results found for {project_name}")
 
 def predict(id_card, config, logger):
-    res = requests.get(
+    res = get_client().get(
         url=f"https://qoca-api.chih-he.dev/user/{id_card}"
     )
     if res.status_code == 200:
@@ -145,7 +160,7 @@ def predict(id_card, config, logger):
         logger.info("Successfully retrieved user info")
 
         now = datetime.now(timezone.utc)
-        res = requests.post(
+        res = get_client().post(
             url=config.predict_url, 
             headers=config.local_headers, 
             json={
@@ -153,7 +168,8 @@ def predict(id_card, config, logger):
                 "id_card": id_card,
                 "name": user_info['name'],
                 "test_date": now.strftime('%Y-%m-%dT%H%M%S.') + f"{int(now.microsecond / 1000):03d}Z"
-            }
+            }, 
+            retry=True # /predict has no side effects
         )
         if (res.status_code == 200):        
             logger.info("Successfully retrieved prediction result")
@@ -180,7 +196,7 @@ def parse_iso_date(s: str) -> str:
 
 def upload_exam(exam, config, logger):
     exam['testDate'] = parse_iso_date(exam['testDate'])
-    res = requests.post(
+    res = get_client().post(
         url='https://qoca-api.chih-he.dev/exams', 
         headers=config.qoca_headers, 
         json=exam
@@ -195,7 +211,7 @@ def upload_exam(exam, config, logger):
         raise Exception(f"{res.text}: {res.status_code}")
 
 def create_task(exam_id, csv_filename, config, logger):
-    res = requests.post(
+    res = get_client().post(
         url='https://qoca-api.chih-he.dev/tasks', 
         headers=config.qoca_headers, 
         json={
@@ -209,6 +225,37 @@ def create_task(exam_id, csv_filename, config, logger):
         logger.error(f"Failed to create task report-generating task (exam_id={exam_id})")
         raise Exception(f"{res.text}: {res.status_code}")
 
+def get_webhook_stages(project_name, config):
+    if project_name == config.exp_textreading_name:
+        return ["fetch", "process", "predict", "upload_exam", "create_task"]
+    else:
+        return ["fetch", "process"]
+
+def run_fetch_stage(payload):
+    payload["filepath"] = fetch_file(
+        payload["project_name"], payload["project_id"], payload["filename"], config, logger
+    )
+    return payload
+
+def run_process_stage(payload):
+    process_file(payload["project_name"], payload["filepath"], config, logger)
+    return payload
+
+def run_predict_stage(payload):
+    subject_id = os.path.basename(payload["filepath"]).split('_')[0]
+    payload["predict_result"] = predict(subject_id, config, logger)
+    return payload
+
+def run_upload_exam_stage(payload):
+    if payload.get("predict_result"):
+        payload["exam_id"] = upload_exam(payload["predict_result"], config, logger)
+    return payload
+
+def run_create_task_stage(payload):
+    if payload.get("exam_id"):
+        create_task(payload["exam_id"], payload["filename"], config, logger)
+    return payload
+
 ## ====================================================================================
 
 load_dotenv()
@@ -217,50 +264,117 @@ config = Config()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)  
 
+fetch_index = FetchIndex(config.fetch_index_path)
+feature_store = get_feature_store(config)
+task_integrator = TaskIntegrator(processors=get_processors()) # shared by all jobs
+job_queue = JobQueue(config.job_db_path, max_attempts=config.job_max_attempts)
+fetch_workers = JobWorkerPool(
+    job_queue, 
+    handlers={
+        "fetch": run_fetch_stage
+    }, 
+    n_workers=config.n_fetch_workers, 
+    name="fetch", 
+    logger=logger
+)
+job_workers = JobWorkerPool( # processing of one subject's files never overlaps
+    job_queue, 
+    handlers={
+        "process": run_process_stage, 
+        "predict": run_predict_stage, 
+        "upload_exam": run_upload_exam_stage, 
+        "create_task": run_create_task_stage
+    }, 
+    n_workers=config.n_job_workers, 
+    exclusive=True, 
+    non_retryable_stages=["upload_exam", "create_task"], # POSTs that may have created the exam or task before failing
+    name="process", 
+    logger=logger
+)
+
 app = FastAPI(docs_url=None)
 
+@app.on_event("startup")
+def start_job_workers():
+    n_requeued = job_queue.requeue_running()
+    if n_requeued > 0:
+        logger.info(f"Requeued {n_requeued} interrupted jobs")
+    fetch_workers.start()
+    job_workers.start()
+    logger.info(f"Started {config.n_fetch_workers} fetch workers and {config.n_job_workers} processing workers")
+
+@app.on_event("shutdown")
+def stop_job_workers():
+    fetch_workers.stop(timeout=5)
+    job_workers.stop(timeout=5)
+
 @app.get("/")
 def read_root():
     return {"Hello": "World"}
 
 @app.post("/webhook")
-async def receive_webhook(request: Request, background_tasks: BackgroundTasks, token: str = Depends(authenticate_gitlab)):
-    body = await request.json()
+def receive_webhook(body: dict = Body(...), token: str = Depends(authenticate_gitlab)):
+    ## Not async: queueing the jobs writes to SQLite, so it runs in FastAPI's thread pool instead of blocking the event loop
     commits = body.get("commits", [])
     print(f"Received {len(commits)} commits")
     
     project_name = body["project"]["name"]
     project_id = body["project"]["id"]
 
+    ## Queue every CSV file added by the commits of the payload, the job workers fetch and process them in parallel
+    summary = []
     for commit in commits:
-        if commit["title"].endswith(".csv") and commit["author"]["name"] == "Pavlovia Committer":
-            filename = os.path.basename(commit["added"][0])
+        if commit.get("author", {}).get("name") != "Pavlovia Committer":
+            summary.append({"commit": commit.get("title"), "status": "skipped", "reason": "not a Pavlovia commit"})
+            continue
+        elif not str(commit.get("title", "")).endswith(".csv"):
+            ## Pavlovia names its commits after the data file, other commits (e.g., of the experiment itself) are not data
+            summary.append({"commit": commit.get("title"), "status": "skipped", "reason": "not a data file commit"})
+            continue
+
+        for added_path in commit.get("added", []):
+            filename = os.path.basename(added_path)
+            if not filename.endswith(".csv"):
+                continue
+            elif filename in [ item.get("filename") for item in summary ]:
+                continue
             logger.info(f"Receiving file: {filename} from project {project_name} ({project_id})")
-            
-            # try:
-            #     if commit["note"] == "a fake commit":
-            #         filepath = os.path.join(config.data_dir, project_name, filename)
-            #         print("This commit is send from 'pseudo_commit.py'")
-            #     else:
-            #         raise KeyError
-            # except KeyError:
-            filepath = fetch_file(project_name, project_id, filename, config, logger)    
-            
-            process_file(project_name, filepath, config, logger)
-
-            if project_name == config.exp_textreading_name:
-                subject_id = os.path.basename(filepath).split('_')[0]
-                predict_result = predict(subject_id, config, logger)
-                # print(predict_result)
-                if predict_result:
-                    exam_id = upload_exam(predict_result, config, logger)
-                    if exam_id:
-                        create_task(exam_id, filename, config, logger)
-
-            return {"status": "ok", "fetched_file": filename}        
-        else:
-            logger.error(f"No valid commit found in the webhook payload")
-            raise HTTPException(status_code=404, detail="No valid commit found!")
+
+            job_id = job_queue.enqueue(
+                kind="webhook", 
+                payload={
+                    "project_name": project_name, 
+                    "project_id": project_id, 
+                    "filename": filename
+                }, 
+                stages=get_webhook_stages(project_name, config), 
+                subject_id=filename.split('_')[0]
+            )
+            logger.info(f"Queued job #{job_id} for {filename}")
+            summary.append({"filename": filename, "status": "queued", "job_id": job_id})
+
+    if not any([ item["status"] == "queued" for item in summary ]):
+        logger.error(f"No valid commit found in the webhook payload")
+        raise HTTPException(status_code=404, detail="No valid commit found!")
+
+    return {"status": "queued", "files": summary}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: int, token: str = Depends(authenticate_gitlab)):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+@app.get("/http_metrics")
+def get_http_metrics(token: str = Depends(authenticate_gitlab)):
+    return get_client().metrics()
+
+@app.get("/result_cache_stats")
+def get_result_cache_stats(token: str = Depends(authenticate_gitlab)):
+    if task_integrator.result_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **task_integrator.result_cache.stats()}
 
 @app.post('/report')
 async def create_report(request: Request):
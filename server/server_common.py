@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+## Shared by the webhook server (server.py) and the other services (process_text_reading.py, get_integrated_result.py);
+## importing this module has no side effect (no job queue, worker pool or feature store is created).
+
+import os
+import threading
+import numpy as np
+
+from fastapi import Header, HTTPException
+
+import util
+from task_integrator import store_result
+from feature_store import open_feature_store
+
+class Config:
+    def __init__(self):
+        self.source_dir = os.path.dirname(os.path.abspath(__file__))
+        self.data_dir = os.path.join(self.source_dir, "..", "data")
+        self.integrated_results_dir = os.path.join(self.source_dir, "integrated_results")
+        self.predict_url = os.getenv("PREDICT_URL")  
+        self.fetch_file_url = "https://gitlab.pavlovia.org/api/v4/projects/{}/repository/files/data%2F{}/raw?ref=master"
+        self.gitlab_token = os.getenv("GITLAB_TOKEN")
+        self.gitlab_headers = {
+            "Authorization": f"Bearer {self.gitlab_token}"
+        }
+        self.local_headers = {
+            "X-GitLab-Token": "tcnl-project",
+            "Content-Type": "application/json"
+        }
+        self.qoca_headers = {
+            "Content-Type": "application/json"
+        }
+        self.exp_gofitt_name = os.getenv("EXPERIMENT_GOFITT_NAME")
+        self.exp_ospan_name = os.getenv("EXPERIMENT_OSPAN_NAME")
+        self.exp_speechcomp_name = os.getenv("EXPERIMENT_SPEECHCOMP_NAME")
+        self.exp_exclusion_name = os.getenv("EXPERIMENT_EXCLUSION_NAME")
+        self.exp_textreading_name = os.getenv("EXPERIMENT_TEXTREADING_NAME")
+        self.exp_name_list = [self.exp_gofitt_name, self.exp_ospan_name, self.exp_speechcomp_name, self.exp_exclusion_name, self.exp_textreading_name]
+        self.platform_features = util.init_platform_features()
+        self.missing_marker = -999
+        self.job_db_path = os.path.join(self.source_dir, "jobs", "webhook_jobs.sqlite3")
+        self.n_job_workers = int(os.getenv("WEBHOOK_WORKERS", 2))
+        self.n_fetch_workers = int(os.getenv("WEBHOOK_FETCH_WORKERS", 4))
+        self.job_max_attempts = int(os.getenv("WEBHOOK_JOB_MAX_ATTEMPTS", 5))
+        self.fetch_index_path = os.path.join(self.data_dir, ".fetch_index.json")
+        self.revalidate_fetched_files = os.getenv("REVALIDATE_FETCHED_FILES", "false").lower() == "true"
+        self.fetch_timeout = 60 # seconds
+        self.fetch_chunk_size = 1024 * 1024 # bytes
+
+def authenticate_gitlab(x_gitlab_token: str = Header(...)):
+    if x_gitlab_token != 'tcnl-project':
+        raise HTTPException(status_code=403)
+    return x_gitlab_token
+
+def convert_np_types(obj):
+    if isinstance(obj, (np.integer, np.int64)):
+        return int(obj)
+    elif isinstance(obj, (np.floating, np.float64)):
+        return float(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist() # Convert np.ndarray to list
+    elif isinstance(obj, np.generic): 
+        return obj.item() # Convert np.generic to scalar
+    elif isinstance(obj, list):
+        return [ convert_np_types(i) for i in obj ] 
+    elif isinstance(obj, dict):
+        return { k: convert_np_types(v) for k, v in obj.items() } 
+    else:
+        return obj
+
+def update_json_result(subject_id, result_df, config, logger):
+    ## Locked read-merge-write (process_text_reading.py and reprocess_cohort.py update the same results from other processes)
+    store_result(
+        get_feature_store(config), subject_id, result_df, config.platform_features, config.missing_marker, default=convert_np_types
+    )
+    logger.info(f"Successfully updated the integrated result of {subject_id}")
+
+_feature_store = None
+_feature_store_lock = threading.Lock()
+
+def get_feature_store(config):
+    '''
+    Returns the process-wide feature store (see open_feature_store() in feature_store.py), opened on first use.
+    '''
+    global _feature_store
+    if _feature_store is None:
+        with _feature_store_lock:
+            if _feature_store is None:
+                _feature_store = open_feature_store(config.integrated_results_dir)
+    return _feature_store
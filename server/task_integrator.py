@@ -2,7 +2,12 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import glob
+import hashlib
+import inspect
+import threading
+import functools
 import pandas as pd
 
 from data_processors.gofitts_processor import GoFittsProcessor
@@ -10,11 +15,80 @@ from data_processors.exclusion_processor import ExclusionProcessor
 from data_processors.ospan_processor import OspanProcessor
 from data_processors.speechcomp_processor import SpeechcompProcessor
 from data_processors.textreading_processor import TextReadingProcessor
+from data_processors.csv_loader import MissingColumnsError
+from result_cache import get_result_cache
+
+def build_processors(data_dir):
+    '''
+    Creates one processor per task, keyed by experiment name (EXPERIMENT_<TASK>_NAME); unset experiments are left out.
+    The processors keep no per-file state, so the same instances can be used by several jobs at once.
+    '''
+    processor_classes = {
+        os.getenv("EXPERIMENT_GOFITT_NAME"): GoFittsProcessor, 
+        os.getenv("EXPERIMENT_OSPAN_NAME"): OspanProcessor, 
+        os.getenv("EXPERIMENT_SPEECHCOMP_NAME"): SpeechcompProcessor, 
+        os.getenv("EXPERIMENT_EXCLUSION_NAME"): ExclusionProcessor, 
+        os.getenv("EXPERIMENT_TEXTREADING_NAME"): TextReadingProcessor
+    }
+    return {
+        exp_name: processor_class(data_dir=os.path.join(data_dir, exp_name))
+        for exp_name, processor_class in processor_classes.items() if exp_name
+    }
+
+_processors = None
+_processors_lock = threading.Lock()
+
+def get_processors():
+    '''
+    Returns the process-wide processor registry, created on first use so that the settings in .env are already loaded.
+    '''
+    global _processors
+    if _processors is None:
+        with _processors_lock:
+            if _processors is None:
+                _processors = build_processors(
+                    data_dir=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+                )
+    return _processors
+
+def get_local_dependencies(module_name):
+    '''
+    Names of the module and of the modules of its package (e.g., data_processors.csv_loader) that it uses, directly or not.
+    '''
+    package = module_name.split(".")[0]
+    dependencies, pending = set(), [module_name]
+    while pending:
+        name = pending.pop()
+        if name in dependencies:
+            continue
+        dependencies.add(name)
+        for value in vars(sys.modules[name]).values():
+            dependency = value.__name__ if inspect.ismodule(value) else getattr(value, "__module__", None)
+            if isinstance(dependency, str) and (dependency.split(".")[0] == package) and (dependency in sys.modules):
+                pending.append(dependency)
+    return sorted(dependencies)
+
+@functools.lru_cache(maxsize=None)
+def get_processor_version(processor_class):
+    '''
+    Short hash of the source of the processor's module and of the shared helpers it uses (csv_loader.py, trajectory_parser.py, ...), 
+    so that the results computed by an older version of any of them can be told apart.
+    '''
+    sha256 = hashlib.sha256()
+    for module_name in get_local_dependencies(processor_class.__module__):
+        with open(sys.modules[module_name].__file__, "rb") as f:
+            sha256.update(module_name.encode() + b"\0" + f.read())
+    return sha256.hexdigest()[:16]
 
 class TaskIntegrator:
-    def __init__(self):
+    def __init__(self, processors=None, result_cache=None, use_result_cache=True):
         self.base_path = os.path.dirname(os.path.abspath(__file__))
         self.data_dir = os.path.join(self.base_path, "..", "data")
+        self.processors = processors if processors is not None else get_processors()
+        if use_result_cache:
+            self.result_cache = result_cache if result_cache is not None else get_result_cache()
+        else:
+            self.result_cache = None # e.g., reprocess_cohort.py --full, where every file must be parsed again
         self.exp_gofitt_name = os.getenv("EXPERIMENT_GOFITT_NAME")
         self.exp_ospan_name = os.getenv("EXPERIMENT_OSPAN_NAME")
         self.exp_speechcomp_name = os.getenv("EXPERIMENT_SPEECHCOMP_NAME")
@@ -43,6 +117,31 @@ class TaskIntegrator:
         else:
             return None
 
+    def run_processor(self, processor, task, file_path):
+        ## The results of the CSV tasks are cached by file content and processor version (see result_cache.py)
+        if (self.result_cache is None) or (task == self.exp_textreading_name):
+            return processor.process_subject(file_path)
+
+        ## The cache only saves time, so a failure to read or write it (e.g., a full disk) does not fail the task
+        key = None
+        try:
+            key = self.result_cache.get_key(file_path, type(processor).__name__, get_processor_version(type(processor)))
+            result = self.result_cache.get(key)
+        except Exception as e:
+            print(f"Failed to read the cached result of {os.path.basename(file_path)}: {str(e)}")
+            result = None
+        if result is not None:
+            print(f"Found cached result of {os.path.basename(file_path)}")
+            return result
+
+        result = processor.process_subject(file_path)
+        if (result is not None) and (key is not None):
+            try:
+                self.result_cache.put(key, result)
+            except Exception as e:
+                print(f"Failed to cache the result of {os.path.basename(file_path)}: {str(e)}")
+        return result
+
     def process_subject(self, subject_id, tasks_to_process=None):          
         results = []
 
@@ -50,13 +149,7 @@ class TaskIntegrator:
             tasks_to_process = self.exp_name_list  
 
         for task in tasks_to_process:
-            processor = {
-                self.exp_gofitt_name: GoFittsProcessor(data_dir=os.path.join(self.data_dir, self.exp_gofitt_name)), 
-                self.exp_ospan_name: OspanProcessor(data_dir=os.path.join(self.data_dir, self.exp_ospan_name)),
-                self.exp_speechcomp_name: SpeechcompProcessor(data_dir=os.path.join(self.data_dir, self.exp_speechcomp_name)),
-                self.exp_exclusion_name: ExclusionProcessor(data_dir=os.path.join(self.data_dir, self.exp_exclusion_name)),
-                self.exp_textreading_name: TextReadingProcessor(data_dir=os.path.join(self.data_dir, self.exp_textreading_name))
-            }.get(task)
+            processor = self.processors.get(task)
             
             if processor is None:
                 print(f"No processor found for task: {task}")
@@ -65,7 +158,11 @@ class TaskIntegrator:
             file_path = self.find_file(processor.data_dir, subject_id, task)            
             if file_path:
                 print(f"Processing {task} for subject {subject_id}")
-                result = processor.process_subject(file_path)
+                try:
+                    result = self.run_processor(processor, task, file_path)
+                except MissingColumnsError as e:
+                    print(f"Skipping {task} for subject {subject_id}: {e}")
+                    continue
                 if result is not None:
                     results.append(result)
             else:
@@ -121,4 +218,13 @@ def process_and_format_result(result_df, platform_features):
                 else:
                     formatted_result[new_key] = value
 
-    return formatted_result
\ No newline at end of file
+    return formatted_result
+
+def store_result(feature_store, subject_id, result_df, platform_features, missing_marker=-999, default=None):
+    ## Merges the features of result_df into the participant's integrated result (see feature_store.py)
+    result_df = result_df.replace([pd.NA, pd.NaT, float('inf'), float('-inf')], missing_marker)
+    result_df = result_df.fillna(missing_marker)
+    formatted_result = process_and_format_result(
+        result_df, platform_features
+    )
+    return feature_store.update(subject_id, formatted_result, missing_marker, default=default)
@@ -3,7 +3,7 @@
 import os
 import sys
 import chardet
-import requests
+from http_client import get_client
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -46,7 +46,7 @@ def upload_file(file_path):
             raise ValueError(f"Unsupported file type: {ext}")
             
         with open(file_path, 'rb') as f:
-            res = requests.post(
+            res = get_client().post(
                 url='https://qoca-api.chih-he.dev/uploadfile', 
                 headers=qoca_headers, 
                 files={'file': f},
@@ -0,0 +1,6 @@
+import os
+import sys
+
+## The server scripts import each other as top-level modules (e.g., "import util"), as when run from server/
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server")
+sys.path.insert(0, os.path.abspath(SERVER_DIR))
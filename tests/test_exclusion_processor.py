@@ -0,0 +1,20 @@
+import os
+import pandas as pd
+import pytest
+
+from data_processors.exclusion_processor import ExclusionProcessor
+
+## expected.csv holds the outputs of the original (per-cell loop) ExclusionProcessor on the fixture files,
+## including its quirks (e.g., only the cue 1 target "yes" rate is kept), which the groupby version must reproduce
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "exclusion")
+EXPECTED = pd.read_csv(os.path.join(FIXTURES_DIR, "expected.csv"), index_col="file")
+
+@pytest.mark.parametrize("file_name", EXPECTED.index.tolist())
+def test_matches_legacy_outputs(file_name):
+    result = ExclusionProcessor(FIXTURES_DIR).process_subject(os.path.join(FIXTURES_DIR, file_name))
+    expected = EXPECTED.loc[[file_name]].reset_index(drop=True)
+
+    assert list(result.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(
+        result.reset_index(drop=True), expected, check_dtype=False, check_exact=False, rtol=0, atol=1e-12
+    )
@@ -0,0 +1,45 @@
+import time
+import numpy as np
+import pytest
+
+from feature_store import FeatureStore, SQLiteFeatureStore
+from export_cohort import Config, export_cohort, load_export
+
+MISSING_MARKER = -999
+FEATURES = ["A", "B", "C"]
+
+@pytest.fixture(params=["json", "sqlite"])
+def feature_store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteFeatureStore(str(tmp_path / "integrated_results.sqlite3"))
+    return FeatureStore(str(tmp_path))
+
+def make_config(export_dir):
+    config = Config()
+    config.export_dir = str(export_dir)
+    config.platform_features = FEATURES
+    return config
+
+def test_incremental_export_after_update(feature_store, tmp_path):
+    config = make_config(tmp_path / "exports")
+    feature_store.update("SUBJ001", { "A": 1.0, "B": MISSING_MARKER, "C": 3.0 }, MISSING_MARKER)
+    feature_store.update("SUBJ002", { "A": 4.0, "B": 5.0 }, MISSING_MARKER)
+    assert export_cohort(feature_store, config) == (2, 2)
+    time.sleep(0.01) # the updates below are after the export
+
+    feature_store.update("SUBJ002", { "B": 6.0, "C": 7.0 }, MISSING_MARKER)
+    feature_store.update("SUBJ000", { "A": 8.0 }, MISSING_MARKER)
+    assert export_cohort(feature_store, config) == (3, 2) # SUBJ001 is kept from the previous export
+
+    subject_ids, features, matrix, _ = load_export(config.export_dir)
+    assert (subject_ids, features) == (["SUBJ000", "SUBJ001", "SUBJ002"], FEATURES)
+    np.testing.assert_array_equal(matrix, [
+        [8.0, np.nan, np.nan],
+        [1.0, np.nan, 3.0],
+        [4.0, 6.0, 7.0]
+    ])
+
+    ## Same as a full export
+    full_config = make_config(tmp_path / "full_export")
+    assert export_cohort(feature_store, full_config, full=True) == (3, 3)
+    np.testing.assert_array_equal(load_export(full_config.export_dir)[2], matrix)
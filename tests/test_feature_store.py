@@ -0,0 +1,98 @@
+import os
+import json
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from feature_store import FeatureStore, SQLiteFeatureStore
+
+SUBJECT_ID = "SUBJ001"
+MISSING_MARKER = -999
+N_PROCESSES = 4
+N_THREADS = 4
+N_UPDATES = 25
+
+def update_features(integrated_results_dir, process_id):
+    ## Runs in a worker process: N_THREADS threads updating the same participant, each with its own features
+    feature_store = FeatureStore(integrated_results_dir)
+
+    def run(thread_id):
+        for k in range(N_UPDATES):
+            feature_store.update(SUBJECT_ID, {
+                f"P{process_id}_T{thread_id}_{k}": k,
+                f"P{process_id}_T{thread_id}_LAST": k,
+                "MISSING": MISSING_MARKER
+            }, MISSING_MARKER)
+
+    threads = [ threading.Thread(target=run, args=(thread_id,)) for thread_id in range(N_THREADS) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def test_concurrent_updates_are_not_lost(tmp_path):
+    integrated_results_dir = str(tmp_path)
+    feature_store = FeatureStore(integrated_results_dir)
+    feature_store.update(SUBJECT_ID, { "KEPT": 1.5 }, MISSING_MARKER)
+    json_file_path = feature_store.get_path(SUBJECT_ID)
+
+    n_reads, partial_reads = [0], []
+    done = threading.Event()
+
+    def read_continuously():
+        ## The file is only ever replaced as a whole, so every read must parse
+        while not done.is_set():
+            with open(json_file_path, "r") as f:
+                content = f.read()
+            try:
+                json.loads(content)
+            except json.JSONDecodeError:
+                partial_reads.append(content)
+            n_reads[0] += 1
+
+    reader = threading.Thread(target=read_continuously)
+    reader.start()
+    try:
+        with ProcessPoolExecutor(max_workers=N_PROCESSES) as executor:
+            futures = [ executor.submit(update_features, integrated_results_dir, process_id) for process_id in range(N_PROCESSES) ]
+            update_features(integrated_results_dir, N_PROCESSES) # and threads of this process at the same time
+            for future in futures:
+                future.result()
+    finally:
+        done.set()
+        reader.join()
+
+    assert n_reads[0] > 0
+    assert partial_reads == []
+
+    integrated_result = feature_store.read(SUBJECT_ID)
+    for process_id in range(N_PROCESSES + 1):
+        for thread_id in range(N_THREADS):
+            for k in range(N_UPDATES):
+                assert integrated_result[f"P{process_id}_T{thread_id}_{k}"] == k
+            assert integrated_result[f"P{process_id}_T{thread_id}_LAST"] == N_UPDATES - 1
+    assert integrated_result["KEPT"] == 1.5
+    assert integrated_result["MISSING"] == MISSING_MARKER
+    assert len(integrated_result) == (N_PROCESSES + 1) * N_THREADS * (N_UPDATES + 1) + 2
+
+    ## No temporary file is left behind
+    assert sorted(os.listdir(integrated_results_dir)) == [".locks", f"{SUBJECT_ID}_integrated_result.json"]
+
+@pytest.fixture(params=["json", "sqlite"])
+def any_feature_store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteFeatureStore(str(tmp_path / "integrated_results.sqlite3"))
+    return FeatureStore(str(tmp_path))
+
+def test_missing_marker_does_not_overwrite(any_feature_store):
+    any_feature_store.update(SUBJECT_ID, { "A": 0.5, "B": MISSING_MARKER }, MISSING_MARKER)
+    merged = any_feature_store.update(SUBJECT_ID, { "A": MISSING_MARKER, "B": 2, "C": MISSING_MARKER }, MISSING_MARKER)
+    assert merged == { "A": 0.5, "B": 2, "C": MISSING_MARKER }
+    assert any_feature_store.read(SUBJECT_ID) == merged
+
+def test_none_overwrites_in_both_backends(any_feature_store):
+    ## None is not the missing marker, so it replaces the stored value (and is replaced by a later one)
+    any_feature_store.update(SUBJECT_ID, { "A": 0.5, "B": 1 }, MISSING_MARKER)
+    assert any_feature_store.update(SUBJECT_ID, { "A": None }, MISSING_MARKER) == { "A": None, "B": 1 }
+    assert any_feature_store.update(SUBJECT_ID, { "A": 0.25, "B": MISSING_MARKER }, MISSING_MARKER) == { "A": 0.25, "B": 1 }
@@ -0,0 +1,41 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processors.gofitts_processor import GoFittsProcessor
+
+## jar_sequence_summary.csv is the -sequence-summary.csv written by GoFitts_modified.jar for GoFitts_GF01.csv,
+## and expected.csv the summary that process_subject_with_jar() made from it
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "gofitts")
+FILE_PATH = os.path.join(FIXTURES_DIR, "GoFitts_GF01.csv")
+
+def assert_same_summary(result, expected):
+    assert list(result.columns) == list(expected.columns)
+    assert result.iloc[0, 0] == expected.iloc[0, 0]
+    np.testing.assert_allclose(
+        result.iloc[0, 1:].to_numpy(dtype=float), expected.iloc[0, 1:].to_numpy(dtype=float), rtol=1e-9, atol=1e-9
+    )
+
+def test_sequences_match_jar():
+    processor = GoFittsProcessor(FIXTURES_DIR)
+    subject_id, df = processor.read_file(FILE_PATH)
+    trials, trajectories = processor.load_trials(df)
+    seq_df = processor.summarize_sequences(df, trials, trajectories)
+
+    expected = pd.read_csv(os.path.join(FIXTURES_DIR, "jar_sequence_summary.csv"))
+    assert seq_df["Sequence"].tolist() == expected["Sequence"].tolist()
+    for col in ["A", "W", "MT", "PT", "TP"]:
+        np.testing.assert_allclose(seq_df[col].to_numpy(dtype=float), expected[col].to_numpy(dtype=float), rtol=1e-9, err_msg=col)
+
+def test_summary_matches_jar():
+    result = GoFittsProcessor(FIXTURES_DIR).process_subject(FILE_PATH)
+    assert_same_summary(result, pd.read_csv(os.path.join(FIXTURES_DIR, "expected.csv")))
+
+@pytest.mark.skipif(shutil.which("java") is None, reason="java is not installed")
+def test_jar_still_matches_fixture(tmp_path):
+    ## The JAR writes its files next to the input, so it runs on a copy
+    file_path = shutil.copy(FILE_PATH, tmp_path)
+    result = GoFittsProcessor(str(tmp_path)).process_subject_with_jar(file_path)
+    assert_same_summary(result, pd.read_csv(os.path.join(FIXTURES_DIR, "expected.csv")))
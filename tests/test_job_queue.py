@@ -0,0 +1,36 @@
+import pytest
+from fastapi import HTTPException
+
+from job_queue import JobQueue, JobWorkerPool
+
+def fail_with(e):
+    def handler(payload):
+        raise e
+    return handler
+
+def make_pool(tmp_path, handlers, **kwargs):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), max_attempts=3, backoff_base=0)
+    return queue, JobWorkerPool(queue, handlers, **kwargs)
+
+def run_once(queue, pool, stages):
+    job_id = queue.enqueue(kind="test", payload={}, stages=stages)
+    pool.run_stage(queue.claim(pool.stages))
+    return queue.get(job_id)
+
+@pytest.mark.parametrize("e", [Exception("connection reset"), HTTPException(status_code=503), HTTPException(status_code=429)])
+def test_transient_errors_are_retried(tmp_path, e):
+    queue, pool = make_pool(tmp_path, { "fetch": fail_with(e) })
+    job = run_once(queue, pool, ["fetch"])
+    assert (job["status"], job["attempts"]) == ("queued", 1)
+
+def test_client_errors_are_not_retried(tmp_path):
+    queue, pool = make_pool(tmp_path, { "fetch": fail_with(HTTPException(status_code=404, detail="not found")) })
+    job = run_once(queue, pool, ["fetch"])
+    assert (job["status"], job["attempts"]) == ("failed", 1)
+
+def test_non_retryable_stages_fail_at_once(tmp_path):
+    queue, pool = make_pool(
+        tmp_path, { "upload_exam": fail_with(Exception("timed out")) }, non_retryable_stages=["upload_exam"]
+    )
+    job = run_once(queue, pool, ["upload_exam", "create_task"])
+    assert (job["status"], job["stage"], job["attempts"]) == ("failed", "upload_exam", 1)
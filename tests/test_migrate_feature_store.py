@@ -0,0 +1,33 @@
+import os
+import numpy as np
+
+from feature_store import FeatureStore, SQLiteFeatureStore
+from migrate_feature_store import Config, migrate
+
+MISSING_MARKER = -999
+
+def test_json_to_sqlite_round_trip(tmp_path):
+    json_store = FeatureStore(str(tmp_path))
+    results = {
+        "SUBJ001": { "ID": "SUBJ001", "A": 0.5, "B": MISSING_MARKER, "C": 3 },
+        "SUBJ002": { "ID": "SUBJ002", "A": MISSING_MARKER, "B": 1.25, "C": None }
+    }
+    for subject_id, integrated_result in results.items():
+        json_store.write(subject_id, integrated_result)
+    os.utime(json_store.get_path("SUBJ001"), (1000, 1000))
+
+    sqlite_store = SQLiteFeatureStore(str(tmp_path / "integrated_results.sqlite3"))
+    assert migrate(json_store, sqlite_store, Config()) == (2, 0)
+    assert sqlite_store.list_subjects() == ["SUBJ001", "SUBJ002"]
+    for subject_id, integrated_result in results.items():
+        assert sqlite_store.read(subject_id) == integrated_result
+    assert sqlite_store.list_subjects(updated_since=2000) == ["SUBJ002"] # keeps the time of the JSON file
+    np.testing.assert_array_equal(
+        sqlite_store.read_matrix(["SUBJ002", "SUBJ001"], ["C", "A", "B"], missing_marker=MISSING_MARKER),
+        json_store.read_matrix(["SUBJ002", "SUBJ001"], ["C", "A", "B"], missing_marker=MISSING_MARKER)
+    )
+
+    ## Running it again changes nothing, and does not overwrite values updated in SQLite since with missing ones
+    sqlite_store.update("SUBJ001", { "B": 2.5 }, MISSING_MARKER)
+    assert migrate(json_store, sqlite_store, Config()) == (2, 0)
+    assert sqlite_store.read("SUBJ001") == { **results["SUBJ001"], "B": 2.5 }
@@ -0,0 +1,19 @@
+import pytest
+
+from data_processors.ospan_processor import OspanProcessor
+
+def write_export(file_path, correct, incorrect):
+    ## 30 trials between empty rows (instructions, practice, end), as in the PsychoPy exports
+    rows = ["指定代號,MathResult,LetterResult"] + ["OS01,,"] * 3
+    rows += [ f"OS01,{correct if i % 3 else incorrect},{correct if i % 2 else incorrect}" for i in range(30) ]
+    rows += ["OS01,,"]
+    file_path.write_text("\n".join(rows) + "\n", encoding="utf-8")
+
+@pytest.mark.parametrize("correct, incorrect", [("1", "0"), ("1.0", "0.0"), ("True", "False")])
+def test_result_encodings(tmp_path, correct, incorrect):
+    file_path = tmp_path / "OS01_ospan_1.csv"
+    write_export(file_path, correct, incorrect)
+    result = OspanProcessor(str(tmp_path)).process_subject(str(file_path))
+    assert result["ID"].tolist() == ["OS01"]
+    assert result["MEMORY_OSPAN_BEH_MATH_ACCURACY"].tolist() == [pytest.approx(20 / 30)]
+    assert result["MEMORY_OSPAN_BEH_LETTER_ACCURACY"].tolist() == [15 * 2.5]
@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import shutil
+import threading
+import importlib
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+from conftest import SERVER_DIR
+from feature_store import FeatureStore
+from model_registry import ModelRegistry
+
+N_SUBJECTS = 12
+N_THREADS = 8
+N_ROUNDS = 3
+
+@pytest.fixture(scope="module")
+def predict():
+    ## predict.py loads the model bundles from paths relative to server/ when imported
+    cwd = os.getcwd()
+    os.chdir(SERVER_DIR)
+    try:
+        module = importlib.import_module("predict")
+    finally:
+        os.chdir(cwd)
+    return module
+
+@pytest.fixture(scope="module")
+def records(predict, tmp_path_factory):
+    ## Random integrated results (with some missing values) for participants of both age groups
+    rng = np.random.default_rng(0)
+    features = set(predict.util.init_platform_features())
+    for age_abb in ["y", "o"]:
+        features |= set(predict.registry.get(age_abb).platform_features)
+
+    feature_store = FeatureStore(str(tmp_path_factory.mktemp("integrated_results")))
+    records = []
+    for i in range(N_SUBJECTS):
+        subject_id = f"SUBJ{i:03d}"
+        feature_store.write(subject_id, {
+            feature: (-999 if rng.random() < 0.05 else float(rng.random())) for feature in sorted(features)
+        })
+        records.append({ "age": int(rng.integers(20, 80)), "id_card": subject_id, "name": f"name {i}", "test_date": "2025-01-01" })
+
+    predict.feature_store, original = feature_store, predict.feature_store
+    yield records
+    predict.feature_store = original
+
+def post(client, path, data):
+    response = client.post(path, data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.get_json()
+
+def test_predict_during_reload_matches_serial(predict, records, monkeypatch):
+    monkeypatch.chdir(SERVER_DIR) # the model paths are relative to server/
+    client = predict.app.test_client()
+    expected = { record["id_card"]: post(client, "/predict", record) for record in records }
+    expected_batch = post(client, "/predict_batch", records)["results"]
+    assert [ result["id_card"] for result in expected_batch ] == [ record["id_card"] for record in records ]
+    assert expected_batch == [ expected[record["id_card"]] for record in records ]
+
+    results, errors, reloads = [], [], []
+    stop = threading.Event()
+
+    def send_requests(worker_id):
+        thread_client = predict.app.test_client()
+        try:
+            for round_id in range(N_ROUNDS):
+                if (worker_id + round_id) % 2 == 0:
+                    for record in records:
+                        results.append((record["id_card"], post(thread_client, "/predict", record)))
+                else:
+                    for record, result in zip(records, post(thread_client, "/predict_batch", { "subjects": records })["results"]):
+                        results.append((record["id_card"], result))
+        except Exception as e:
+            errors.append(e)
+
+    def reload_models():
+        reload_client = predict.app.test_client()
+        try:
+            while not stop.is_set():
+                reloads.append(post(reload_client, "/reload_models", { "force": True })["reloaded"])
+        except Exception as e:
+            errors.append(e)
+
+    reloader = threading.Thread(target=reload_models)
+    reloader.start()
+    threads = [ threading.Thread(target=send_requests, args=(i,)) for i in range(N_THREADS) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stop.set()
+    reloader.join()
+
+    assert errors == []
+    assert len(reloads) > 0 and all([ sorted(reloaded) == ["o", "y"] for reloaded in reloads ])
+    assert len(results) == N_THREADS * N_ROUNDS * N_SUBJECTS
+    for subject_id, result in results:
+        assert result == expected[subject_id]
+
+def test_refresh_reloads_changed_files(tmp_path):
+    ## A worker that did not serve /reload_models picks up new model files on its next request
+    for name in ["model", "scaler"]:
+        shutil.copytree(os.path.join(SERVER_DIR, "prediction", name), tmp_path / name)
+    config = SimpleNamespace(
+        model_path_template=str(tmp_path / "model" / "<age_abb>"),
+        scaler_path_template=str(tmp_path / "scaler" / "scaler_<age_full>.pkl"),
+        percentiles_path_template=str(tmp_path / "scaler" / "cognitive_percentiles_<age_full>.pkl")
+    )
+    registry = ModelRegistry(config)
+    registry.load_all()
+    old_bundle = registry.get("o")
+
+    assert registry.refresh(min_interval=0) == {}
+    model_path = config.model_path_template.replace("<age_abb>", "o")
+    os.utime(model_path, (time.time() + 10, time.time() + 10))
+    assert registry.refresh(min_interval=0.5) == {} # not checked again within min_interval
+    time.sleep(0.5)
+    assert list(registry.refresh(min_interval=0.5).keys()) == ["o"]
+    assert registry.get("o") is not old_bundle
+    assert registry.get("y") is not None
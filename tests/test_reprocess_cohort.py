@@ -0,0 +1,80 @@
+import os
+import json
+import shutil
+import pandas as pd
+import pytest
+
+import result_cache
+import task_integrator
+from feature_store import FeatureStore
+from reprocess_cohort import Config, find_runs, reprocess, load_manifest
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "exclusion")
+EXPECTED = pd.read_csv(os.path.join(FIXTURES_DIR, "expected.csv"), index_col="file")
+TASK = "Exclusion"
+FEATURE = "MEMORY_EXCLUSION_BEH_C1TarHit_RT"
+FILE_NAMES = ["random_0.csv", "random_1.csv", "random_2.csv", "random_3.csv"]
+
+@pytest.fixture
+def cohort(tmp_path, monkeypatch):
+    ## data/<EXPERIMENT_NAME> with one exclusion file per participant, and a result cache of its own
+    ## (the worker processes are forked, so they see the patched processors and settings)
+    for name in ["GOFITT", "OSPAN", "SPEECHCOMP", "TEXTREADING"]:
+        monkeypatch.delenv(f"EXPERIMENT_{name}_NAME", raising=False)
+    monkeypatch.setenv("EXPERIMENT_EXCLUSION_NAME", TASK)
+    monkeypatch.setenv("RESULT_CACHE_ENABLED", "true")
+    monkeypatch.setenv("RESULT_CACHE_DIR", str(tmp_path / "result_cache"))
+    monkeypatch.setattr(result_cache, "_cache", None)
+
+    data_dir = tmp_path / "data"
+    os.makedirs(data_dir / TASK)
+    for i, file_name in enumerate(FILE_NAMES):
+        shutil.copy(os.path.join(FIXTURES_DIR, file_name), data_dir / TASK / f"SUBJ{i:03d}_{TASK}_1.csv")
+    monkeypatch.setattr(task_integrator, "_processors", task_integrator.build_processors(str(data_dir)))
+
+    config = Config()
+    config.data_dir = str(data_dir)
+    config.manifest_path = str(data_dir / ".reprocess_manifest.json")
+    config.n_workers = 2
+    return config, FeatureStore(str(tmp_path / "integrated_results"))
+
+def assert_expected_features(feature_store, missing_marker):
+    for i, file_name in enumerate(FILE_NAMES):
+        expected = EXPECTED.loc[file_name, FEATURE]
+        value = feature_store.read(f"SUBJ{i:03d}")[FEATURE]
+        assert value == (missing_marker if pd.isna(expected) else pytest.approx(expected))
+
+def test_only_changed_or_failed_runs_are_reprocessed(cohort):
+    config, feature_store = cohort
+    manifest = load_manifest(config)
+    runs = find_runs([TASK], manifest, config)
+    assert sorted([ subject_id for _, subject_id, _ in runs ]) == ["SUBJ000", "SUBJ001", "SUBJ002", "SUBJ003"]
+    assert reprocess(runs, feature_store, manifest, config) == (4, 0)
+    assert_expected_features(feature_store, config.missing_marker)
+
+    manifest = load_manifest(config)
+    assert find_runs([TASK], manifest, config) == []
+
+    ## A new raw file, and a run that gave no result, are processed again
+    shutil.copy(os.path.join(FIXTURES_DIR, "few_trials.csv"), os.path.join(config.data_dir, TASK, f"SUBJ000_{TASK}_1.csv"))
+    manifest[f"{TASK}/SUBJ003"]["has_result"] = False
+    assert sorted([ subject_id for _, subject_id, _ in find_runs([TASK], manifest, config) ]) == ["SUBJ000", "SUBJ003"]
+
+def test_full_does_not_use_cached_results(cohort):
+    config, feature_store = cohort
+    manifest = load_manifest(config)
+    reprocess(find_runs([TASK], manifest, config), feature_store, manifest, config)
+
+    ## Results served from the cache would now be wrong
+    cache_dir = os.environ["RESULT_CACHE_DIR"]
+    for file_name in os.listdir(cache_dir):
+        with open(os.path.join(cache_dir, file_name), "r") as f:
+            entry = json.load(f)
+        entry["values"][entry["columns"].index(FEATURE)] = 12345
+        with open(os.path.join(cache_dir, file_name), "w") as f:
+            json.dump(entry, f)
+
+    runs = find_runs([TASK], manifest, config, full=True)
+    assert len(runs) == 4
+    assert reprocess(runs, feature_store, manifest, config, use_result_cache=False) == (4, 0)
+    assert_expected_features(feature_store, config.missing_marker)
@@ -0,0 +1,41 @@
+import os
+import threading
+import pandas as pd
+
+from result_cache import ResultCache
+
+def make_result(i):
+    return pd.DataFrame([[f"SUBJ{i:03d}", float(i), i]], columns=["ID", "FEATURE_A", "FEATURE_B"])
+
+def test_put_and_get(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    file_path = tmp_path / "raw.csv"
+    file_path.write_text("a,b\n1,2\n")
+    key = cache.get_key(str(file_path), "ExclusionProcessor", "0123456789abcdef")
+
+    assert cache.get(key) is None
+    cache.put(key, make_result(1))
+    pd.testing.assert_frame_equal(cache.get(key), make_result(1))
+    assert cache.get_key(str(file_path), "ExclusionProcessor", "fedcba9876543210") != key
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+def test_concurrent_eviction(tmp_path):
+    ## Several caches (e.g., processes) sharing one small directory evict each other's entries while scanning it
+    caches = [ ResultCache(str(tmp_path), max_size_mb=0.002) for _ in range(4) ]
+    errors = []
+
+    def put_many(cache, offset):
+        try:
+            for i in range(200):
+                cache.put(f"{offset}_{i}", make_result(i))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [ threading.Thread(target=put_many, args=(cache, j)) for j, cache in enumerate(caches) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sum([ os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path) ]) <= 0.002 * 1024 * 1024
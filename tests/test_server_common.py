@@ -0,0 +1,22 @@
+import os
+import sys
+import subprocess
+
+from conftest import SERVER_DIR
+
+def test_services_do_not_import_server():
+    ## process_text_reading.py and get_integrated_result.py must not create the webhook job queue (server/jobs) when imported
+    jobs_dir = os.path.join(SERVER_DIR, "jobs")
+    existed = os.path.exists(jobs_dir)
+    result = subprocess.run([
+            sys.executable, "-c", 
+            "import sys, process_text_reading, get_integrated_result; print('server' in sys.modules)"
+        ], 
+        cwd=SERVER_DIR, 
+        env={ **os.environ, "FEATURE_STORE_BACKEND": "json" }, 
+        capture_output=True, 
+        text=True
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "False"
+    assert os.path.exists(jobs_dir) == existed
@@ -0,0 +1,53 @@
+import sys
+import shutil
+import pandas as pd
+
+from task_integrator import TaskIntegrator, get_local_dependencies, get_processor_version
+from result_cache import ResultCache
+from data_processors.gofitts_processor import GoFittsProcessor
+from data_processors.exclusion_processor import ExclusionProcessor
+
+def test_dependencies_include_shared_helpers():
+    assert get_local_dependencies(GoFittsProcessor.__module__) == [
+        "data_processors.csv_loader", "data_processors.gofitts_processor", "data_processors.trajectory_parser"
+    ]
+    assert "data_processors.csv_loader" in get_local_dependencies(ExclusionProcessor.__module__)
+
+def test_version_changes_with_a_helper(tmp_path, monkeypatch):
+    ## Same processor module, edited copy of csv_loader.py
+    csv_loader = sys.modules["data_processors.csv_loader"]
+    edited_path = tmp_path / "csv_loader.py"
+    shutil.copy(csv_loader.__file__, edited_path)
+    with open(edited_path, "a") as f:
+        f.write("\n# edited\n")
+
+    version = get_processor_version(GoFittsProcessor)
+    get_processor_version.cache_clear()
+    monkeypatch.setattr(csv_loader, "__file__", str(edited_path))
+    try:
+        assert get_processor_version(GoFittsProcessor) != version
+        assert get_processor_version(GoFittsProcessor) == get_processor_version(GoFittsProcessor)
+    finally:
+        get_processor_version.cache_clear()
+
+class BrokenResultCache(ResultCache):
+    def get(self, key):
+        raise OSError("Input/output error")
+
+    def put(self, key, result_df):
+        raise OSError("No space left on device")
+
+class ExclusionStub:
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+
+    def process_subject(self, file_path):
+        return pd.DataFrame([["SUBJ001", 0.5]], columns=["ID", "FEATURE_A"])
+
+def test_cache_failures_do_not_fail_the_task(tmp_path):
+    (tmp_path / "SUBJ001_Exclusion_1.csv").write_text("a,b\n1,2\n")
+    integrator = TaskIntegrator(
+        processors={ "Exclusion": ExclusionStub(str(tmp_path)) }, result_cache=BrokenResultCache(str(tmp_path / "cache"))
+    )
+    result = integrator.process_subject("SUBJ001", tasks_to_process=["Exclusion"])
+    assert result["FEATURE_A"].tolist() == [0.5]
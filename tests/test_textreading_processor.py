@@ -0,0 +1,143 @@
+import os
+import shutil
+import socket
+import threading
+import numpy as np
+import pytest
+
+from data_processors.textreading_processor import TextReadingProcessor
+from data_processors.transcript_cache import TranscriptCache
+
+def make_word_timings():
+    return {
+        "word": np.array(["今天", "天氣", "很好"], dtype=str), 
+        "start": np.array([0.0, 0.5, 1.1]), 
+        "end": np.array([0.4, 1.0, 1.6])
+    }
+
+def make_processor(tmp_path, monkeypatch, word_timings):
+    processor = TextReadingProcessor(str(tmp_path))
+    monkeypatch.setattr(processor, "transcribe", lambda audio_file: word_timings)
+    audio_file = tmp_path / "SUBJ001_TextReading_1.webm"
+    audio_file.write_bytes(b"audio")
+    return processor, str(audio_file)
+
+def test_transcript_is_cached(tmp_path, monkeypatch):
+    processor, audio_file = make_processor(tmp_path, monkeypatch, make_word_timings())
+    processor.get_word_timings(audio_file)
+
+    monkeypatch.setattr(processor, "transcribe", lambda audio_file: None)
+    word_timings = processor.get_word_timings(audio_file)
+    assert word_timings["word"].tolist() == make_word_timings()["word"].tolist()
+    np.testing.assert_allclose(word_timings["end"], make_word_timings()["end"])
+
+def test_cache_failure_keeps_the_transcript(tmp_path, monkeypatch):
+    processor, audio_file = make_processor(tmp_path, monkeypatch, make_word_timings())
+
+    def fail(*args, **kwargs):
+        raise OSError("No space left on device")
+    monkeypatch.setattr(processor.cache, "put", fail)
+
+    word_timings = processor.get_word_timings(audio_file)
+    assert word_timings["word"].tolist() == make_word_timings()["word"].tolist()
+    assert [ name for name in os.listdir(tmp_path) if name.endswith(".csv") ] == [] # no temporary CSV left behind
+
+def test_evict_skips_vanished_entries(tmp_path, monkeypatch):
+    cache = TranscriptCache(str(tmp_path), "small", max_size_mb=0)
+    for key in ["a", "b", "c"]:
+        os.makedirs(cache.get_entry_dir(key))
+        with open(os.path.join(cache.get_entry_dir(key), "words.csv"), "w") as f:
+            f.write("word,start,end\n")
+
+    ## Another process evicts entry "b" between the directory scan and its size
+    get_size = cache.get_size
+    def get_size_after_removal(entry_dir):
+        if entry_dir == cache.get_entry_dir("b"):
+            shutil.rmtree(entry_dir)
+        return get_size(entry_dir)
+    monkeypatch.setattr(cache, "get_size", get_size_after_removal)
+
+    cache.evict()
+    assert os.listdir(os.path.join(str(tmp_path), "small")) == []
+
+def test_worker_timeout_falls_back_to_subprocess(tmp_path, monkeypatch):
+    ## A worker that accepts the connection but never answers
+    socket_path = str(tmp_path / "whisper_worker.sock")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    monkeypatch.setenv("WHISPER_WORKER_SOCKET", socket_path)
+    monkeypatch.setenv("WHISPER_WORKER_TIMEOUT", "0.2")
+
+    processor = TextReadingProcessor(str(tmp_path), use_cache=False)
+    monkeypatch.setattr(processor, "transcribe_with_subprocess", lambda audio_file: make_word_timings())
+    try:
+        word_timings = processor.transcribe(str(tmp_path / "SUBJ001_TextReading_1.webm"))
+    finally:
+        server.close()
+    assert word_timings["word"].tolist() == make_word_timings()["word"].tolist()
+
+def test_empty_file_does_not_make_the_mean_nan(tmp_path):
+    processor = TextReadingProcessor(str(tmp_path), use_cache=False)
+    empty = { "word": np.array([], dtype=str), "start": np.array([]), "end": np.array([]) }
+    word_timings = make_word_timings()
+    rate = np.mean((np.array([2, 2, 2]) / (word_timings["end"] - word_timings["start"])))
+
+    assert processor.calculate_mean_syllable_speech_rate([word_timings, empty]) == pytest.approx(rate)
+    assert np.isnan(processor.calculate_mean_syllable_speech_rate([empty, empty]))
+
+def test_cache_entry_evicted_while_read_is_a_miss(tmp_path, monkeypatch):
+    processor, audio_file = make_processor(tmp_path, monkeypatch, make_word_timings())
+    processor.get_word_timings(audio_file)
+    key = processor.cache.get_key(audio_file)
+
+    ## Another process evicts the entry between the lookup and the read of its CSV
+    get = processor.cache.get
+    def get_then_evict(key):
+        csv_file = get(key)
+        shutil.rmtree(processor.cache.get_entry_dir(key))
+        return csv_file
+    monkeypatch.setattr(processor.cache, "get", get_then_evict)
+    transcribed = []
+    monkeypatch.setattr(processor, "transcribe", lambda audio_file: transcribed.append(audio_file) or make_word_timings())
+
+    word_timings = processor.get_word_timings(audio_file)
+    assert transcribed == [audio_file]
+    assert word_timings["word"].tolist() == make_word_timings()["word"].tolist()
+
+def test_get_is_a_miss_when_the_entry_vanishes(tmp_path, monkeypatch):
+    cache = TranscriptCache(str(tmp_path), "small")
+    os.makedirs(cache.get_entry_dir("a"))
+    with open(os.path.join(cache.get_entry_dir("a"), "words.csv"), "w") as f:
+        f.write("word,0.0,0.5\n")
+
+    def utime(path, *args, **kwargs):
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(os, "utime", utime)
+    assert cache.get("a") is None
+
+@pytest.mark.parametrize("answer", [b"", b"{\"word\": [\"\n"])
+def test_worker_failure_falls_back_to_subprocess(tmp_path, monkeypatch, answer):
+    ## A worker that closes the connection without a (complete) response, e.g., because it crashed
+    socket_path = str(tmp_path / "whisper_worker.sock")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+
+    def answer_and_close():
+        conn, _ = server.accept()
+        conn.recv(4096)
+        conn.sendall(answer)
+        conn.close()
+    thread = threading.Thread(target=answer_and_close)
+    thread.start()
+    monkeypatch.setenv("WHISPER_WORKER_SOCKET", socket_path)
+
+    processor = TextReadingProcessor(str(tmp_path), use_cache=False)
+    monkeypatch.setattr(processor, "transcribe_with_subprocess", lambda audio_file: make_word_timings())
+    try:
+        word_timings = processor.transcribe(str(tmp_path / "SUBJ001_TextReading_1.webm"))
+    finally:
+        thread.join()
+        server.close()
+    assert word_timings["word"].tolist() == make_word_timings()["word"].tolist()
@@ -0,0 +1,18 @@
+import numpy as np
+import pandas as pd
+
+from data_processors.trajectory_parser import Trajectories
+
+def make_trajectories(cells):
+    x = pd.Series(cells, name="mouse.x")
+    return Trajectories.from_columns(x, x.rename("mouse.y"), x.rename("mouse.time"))
+
+def test_first_and_last_of_empty_trials_are_nan():
+    trajectories = make_trajectories(["[1.0, 2.0]", "[]", "[3.0]", "[]"])
+    np.testing.assert_array_equal(trajectories.first(trajectories.x), [1.0, np.nan, 3.0, np.nan])
+    np.testing.assert_array_equal(trajectories.last(trajectories.x), [2.0, np.nan, 3.0, np.nan])
+
+def test_all_trials_empty():
+    trajectories = make_trajectories(["[]", "[]"])
+    np.testing.assert_array_equal(trajectories.first(trajectories.t), [np.nan, np.nan])
+    np.testing.assert_array_equal(trajectories.last(trajectories.t), [np.nan, np.nan])